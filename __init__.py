@@ -1,5 +1,7 @@
 import sys
 import os
+import threading
+import atexit
 
 current_dir = os.path.dirname(__file__)
 if current_dir not in sys.path:
@@ -12,15 +14,17 @@ NODE_CLASS_MAPPINGS = {}
 __all__ = ["NODE_CLASS_MAPPINGS", "WEB_DIRECTORY", "start_backend_server"]
 
 _backend_server = None
+_backend_thread = None
+_backend_lock = threading.Lock()
 
 
 def start_backend_server(host: str = "127.0.0.1", port: int = 8000):
-    import uvicorn
-
-    global _backend_server
+    global _backend_server, _backend_thread
 
-    if _backend_server is None:
-        import threading
+    with _backend_lock:
+        if _backend_thread is not None:
+            print("⚠️  Backend server is already running!")
+            return _backend_thread
 
         print("=" * 60)
         print("🚀 Starting ComfyUI Workflow Agent Backend Server")
@@ -32,50 +36,49 @@ def start_backend_server(host: str = "127.0.0.1", port: int = 8000):
         print("=" * 60)
 
         def run_server():
-            print(f"\n✅ Backend server is running on http://{host}:{port}")
-            print(f"⏰ Started at: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"💡 Press Ctrl+C to stop the server\n")
+            global _backend_server
 
             try:
+                # 在后台线程中导入，避免阻塞 ComfyUI 加载自定义节点；缺少依赖时只打印错误
+                import uvicorn
                 from backend.main import app
-                uvicorn.run(app, host=host, port=port, log_level="info")
+
+                # loop/http 为 auto 时会在可用时选用 uvloop/httptools（Windows 上没有 uvloop）
+                config = uvicorn.Config(app, host=host, port=port, loop="auto", http="auto", log_level="info")
+                _backend_server = uvicorn.Server(config)
+
+                print(f"\n✅ Backend server is running on http://{host}:{port}")
+                print(f"⏰ Started at: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                print(f"💡 Press Ctrl+C to stop the server\n")
+
+                _backend_server.run()
             except Exception as e:
-                print(f"❌ Error loading backend module: {e}")
+                print(f"❌ Failed to start backend server: {e}")
                 import traceback
                 traceback.print_exc()
-                raise
 
-        _backend_server = threading.Thread(target=run_server, daemon=True)
-        _backend_server.start()
+        _backend_thread = threading.Thread(target=run_server, name="comfy-agent-backend", daemon=True)
+        _backend_thread.start()
 
         print(f"🔄 Backend server thread started in background")
         print("=" * 60)
-    else:
-        print("⚠️  Backend server is already running!")
 
-    return _backend_server
+    return _backend_thread
 
 
 _start_backend_server = start_backend_server
 
-import threading
-import atexit
-
-
-def _auto_start_backend():
-    try:
-        start_backend_server(host="127.0.0.1", port=8000)
-    except Exception as e:
-        print(f"❌ Failed to start backend server: {e}")
-
 
 def _cleanup():
-    global _backend_server
     if _backend_server is not None:
         print("🛑 Shutting down backend server...")
+        _backend_server.should_exit = True
 
 
-_thread = threading.Thread(target=_auto_start_backend, daemon=True)
-_thread.start()
+try:
+    start_backend_server(host="127.0.0.1", port=8000)
+except Exception as e:
+    # 后端启动失败不能影响 ComfyUI 加载本扩展
+    print(f"❌ Failed to start backend server: {e}")
 
 atexit.register(_cleanup)
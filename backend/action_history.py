@@ -1,44 +1,145 @@
-from typing import Dict, Any, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 import uuid
+from dataclasses import dataclass, asdict
+
+import aiosqlite
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    action_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    action_type TEXT NOT NULL,
+    action_data TEXT,
+    previous_state TEXT,
+    ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_actions_session ON actions(session_id, ts);
+"""
+
+
+@dataclass(slots=True)
+class ActionRecord:
+    action_id: str
+    session_id: str
+    action_type: str
+    action_data: Dict[str, Any]
+    previous_state: Optional[Dict[str, Any]]
+    timestamp_ns: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化输出时才生成 dict 和 ISO 时间"""
+        data = asdict(self)
+        data["timestamp"] = datetime.fromtimestamp(self.timestamp_ns / 1e9).isoformat()
+        return data
 
 
 class ActionHistory:
-    def __init__(self):
-        self.actions: Dict[str, Dict[str, Any]] = {}
-    
-    def add_action(
+    """基于 SQLite (WAL) 的操作历史，复用同一个长连接"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or settings.SQLITE_DB
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = asyncio.Lock()
+
+    async def _get_conn(self) -> aiosqlite.Connection:
+        loop = asyncio.get_running_loop()
+        if self._conn is not None and self._loop is loop:
+            return self._conn
+
+        async with self._lock:
+            if self._conn is not None and self._loop is not loop:
+                # 连接绑定在旧的事件循环上，不能跨循环复用；先关闭，避免泄漏连接和后台线程
+                await self._close_conn()
+            if self._conn is None:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                conn = await aiosqlite.connect(self.db_path)
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.executescript(_SCHEMA)
+                await conn.commit()
+                conn.row_factory = aiosqlite.Row
+                self._conn = conn
+                self._loop = loop
+                logger.info(f"Action history database ready: {self.db_path}")
+        return self._conn
+
+    async def add_action(
         self,
         session_id: str,
         action_type: str,
         action_data: Dict[str, Any],
         previous_state: Optional[Dict[str, Any]] = None
     ) -> str:
-        action_id = str(uuid.uuid4())
-        self.actions[action_id] = {
-            "action_id": action_id,
-            "session_id": session_id,
-            "action_type": action_type,
-            "action_data": action_data,
-            "previous_state": previous_state,
-            "timestamp": datetime.now().isoformat()
-        }
+        action_id = uuid.uuid4().hex
+        conn = await self._get_conn()
+        await conn.execute(
+            "INSERT INTO actions (action_id, session_id, action_type, action_data, previous_state, ts) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                action_id,
+                session_id,
+                action_type,
+                json.dumps(action_data, ensure_ascii=False, default=str),
+                json.dumps(previous_state, ensure_ascii=False, default=str) if previous_state is not None else None,
+                time.time_ns()
+            )
+        )
+        await conn.commit()
         return action_id
-    
-    def get_action(self, action_id: str) -> Optional[Dict[str, Any]]:
-        return self.actions.get(action_id)
-    
-    def undo_action(self, action_id: str) -> Optional[Dict[str, Any]]:
-        action = self.actions.get(action_id)
+
+    @staticmethod
+    def _row_to_action(row: aiosqlite.Row) -> ActionRecord:
+        return ActionRecord(
+            action_id=row["action_id"],
+            session_id=row["session_id"],
+            action_type=row["action_type"],
+            action_data=json.loads(row["action_data"]) if row["action_data"] else {},
+            previous_state=json.loads(row["previous_state"]) if row["previous_state"] else None,
+            timestamp_ns=int(row["ts"])
+        )
+
+    async def get_action(self, action_id: str) -> Optional[ActionRecord]:
+        conn = await self._get_conn()
+        async with conn.execute("SELECT * FROM actions WHERE action_id = ?", (action_id,)) as cursor:
+            row = await cursor.fetchone()
+        return self._row_to_action(row) if row else None
+
+    async def undo_action(self, action_id: str) -> Optional[Dict[str, Any]]:
+        action = await self.get_action(action_id)
         if action:
-            return action.get("previous_state")
+            return action.previous_state
         return None
-    
-    def get_session_actions(self, session_id: str) -> list[Dict[str, Any]]:
-        return [
-            action for action in self.actions.values()
-            if action["session_id"] == session_id
-        ]
+
+    async def get_session_actions(self, session_id: str) -> List[ActionRecord]:
+        conn = await self._get_conn()
+        async with conn.execute(
+            "SELECT * FROM actions WHERE session_id = ? ORDER BY ts", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [self._row_to_action(row) for row in rows]
+
+    async def _close_conn(self) -> None:
+        conn, self._conn, self._loop = self._conn, None, None
+        try:
+            await conn.close()
+        except Exception as e:
+            logger.warning(f"Failed to close action history connection: {e}")
+
+    async def aclose(self) -> None:
+        if self._conn is not None:
+            await self._close_conn()
 
 
 action_history = ActionHistory()
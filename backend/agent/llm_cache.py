@@ -0,0 +1,32 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+from cachetools import TTLCache
+
+
+class LLMResponseCache:
+    """进程内的 LLM 响应缓存，按请求内容的 SHA256 精确匹配"""
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 3600):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def make_key(prompt: Any, model: Optional[str], temperature: Optional[float] = None) -> str:
+        payload = json.dumps(
+            {"prompt": prompt, "model": model, "temperature": temperature},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, prompt: Any, model: Optional[str], temperature: Optional[float] = None) -> Optional[str]:
+        return self._cache.get(self.make_key(prompt, model, temperature))
+
+    def set(self, prompt: Any, model: Optional[str], value: str, temperature: Optional[float] = None) -> None:
+        if value:
+            self._cache[self.make_key(prompt, model, temperature)] = value
+
+    def clear(self) -> None:
+        self._cache.clear()
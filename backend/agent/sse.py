@@ -0,0 +1,20 @@
+from typing import AsyncIterator
+
+import httpx
+
+
+async def iter_sse_data(response: httpx.Response) -> AsyncIterator[bytes]:
+    """按字节切分 SSE 流，逐个产出 data 字段去掉首尾空白后的负载"""
+    buf = bytearray()
+    async for chunk in response.aiter_bytes():
+        buf += chunk
+        start = 0
+        while (nl := buf.find(b"\n", start)) != -1:
+            if buf.startswith(b"data:", start):
+                # 去掉行尾的 \r 和空白，"data: [DONE] " 也能识别为结束标记
+                yield bytes(buf[start + 5:nl]).strip()
+            start = nl + 1
+        if start:
+            del buf[:start]
+    if buf.startswith(b"data:"):
+        yield bytes(buf[5:]).strip()
@@ -0,0 +1,91 @@
+import logging
+from functools import lru_cache
+from typing import Any, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_TRUNCATED_MARKER = "\n...[truncated]...\n"
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model_name: Optional[str]):
+    """按模型取 tiktoken 编码器，不可用时返回 None 并退化为按字符估算"""
+    if tiktoken is None:
+        return None
+    try:
+        encoding_name = tiktoken.encoding_name_for_model(model_name or "")
+    except KeyError:
+        encoding_name = "cl100k_base"
+    return _load_encoding(encoding_name)
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(encoding_name: str):
+    # 首次加载可能需要下载词表，失败结果同样缓存，避免每次调用都重试
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {encoding_name} unavailable, falling back to char estimate: {e}")
+        return None
+
+
+def _content_text(message: Any) -> str:
+    content = getattr(message, "content", message)
+    return content if isinstance(content, str) else str(content)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _shrink(message: Any, max_tokens: int, model_name: Optional[str]) -> Any:
+    """单条消息超出预算时保留首尾，截掉中间部分"""
+    text = _content_text(message)
+    ratio = max_tokens / max(count_tokens(text, model_name), 1)
+    keep = max(int(len(text) * ratio) - len(_TRUNCATED_MARKER), 0)
+    head = keep * 2 // 3
+    tail = keep - head
+    shrunk = text[:head] + _TRUNCATED_MARKER + (text[-tail:] if tail else "")
+    if hasattr(message, "model_copy"):
+        return message.model_copy(update={"content": shrunk})
+    return shrunk
+
+
+def truncate_messages(messages: List[Any], max_tokens: int, model_name: Optional[str] = None) -> List[Any]:
+    """按 token 预算截断历史：固定保留第一条作为稳定前缀，其余从最新往前填充，丢弃中间消息"""
+    if not messages:
+        return []
+
+    latest = messages[-1]
+    latest_tokens = count_tokens(_content_text(latest), model_name)
+    if latest_tokens >= max_tokens:
+        return [_shrink(latest, max_tokens, model_name)]
+
+    budget = max_tokens - latest_tokens
+    head: List[Any] = []
+    first_index = 0
+    if len(messages) > 1:
+        first_tokens = count_tokens(_content_text(messages[0]), model_name)
+        if first_tokens <= budget // 2:
+            head = [messages[0]]
+            budget -= first_tokens
+            first_index = 1
+
+    tail: List[Any] = [latest]
+    for message in reversed(messages[first_index:-1]):
+        tokens = count_tokens(_content_text(message), model_name)
+        if tokens > budget:
+            break
+        budget -= tokens
+        tail.append(message)
+    tail.reverse()
+    return head + tail
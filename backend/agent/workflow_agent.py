@@ -1,13 +1,19 @@
 
 
 import asyncio
+import hashlib
 import json
 import logging
 import os
+import re
 import sqlite3
-from typing import TypedDict, Annotated, List, Dict, Any, Optional, AsyncGenerator
+import time
+from contextlib import asynccontextmanager
+from typing import TypedDict, Annotated, List, Dict, Any, Optional, AsyncGenerator, Tuple
 
 import httpx
+import orjson
+from cachetools import LRUCache
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
@@ -16,9 +22,83 @@ from langchain_core.callbacks.manager import adispatch_custom_event
 
 from backend.models import APIProviderConfig
 from backend.config import settings
+from backend.agent.llm_cache import LLMResponseCache
+from backend.agent.sse import iter_sse_data
+from backend.agent.token_budget import truncate_messages
+from backend.tools.search_tools import SearchTools
+from backend.tools.workflow_analyzer import workflow_analyzer
+from backend.tools.action_tools import ActionTools
+
+try:
+    from langchain_openai import ChatOpenAI
+except ImportError:
+    ChatOpenAI = None
+
+try:
+    from langchain_anthropic import ChatAnthropic
+except ImportError:
+    ChatAnthropic = None
+
+try:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+except ImportError:
+    ChatGoogleGenerativeAI = None
 
 logger = logging.getLogger(__name__)
 
+# 本地规则分类用的关键字，命中时无需调用 LLM
+_SEARCH_KEYWORDS_RE = re.compile(r"\b(error|traceback|exception|failed)\b|报错|错误|异常|失败", re.IGNORECASE)
+_ANALYZE_KEYWORDS_RE = re.compile(r"\b(analyze|explain|understand|what does)\b|分析|解释", re.IGNORECASE)
+_GREETING_RE = re.compile(r"^(?:(?:hi|hello|hey|thanks|thank you|ok)\b|你好|谢谢|好的)", re.IGNORECASE)
+
+# Custom API 模板中的 $var 占位符
+_TEMPLATE_RE = re.compile(r"\$(\w+)")
+
+_LANGUAGE_INTROS = {
+    "en": "You are ComfyUI Workflow Agent, an expert assistant specialized in ComfyUI workflows.",
+    "zh": "你是 ComfyUI 工作流助手，专门帮助用户解决 ComfyUI 工作流问题。",
+    "ja": "あなたは ComfyUI ワークフローエージェントです。",
+    "ko": "당신은 ComfyUI 워크플로우 에이전트입니다."
+}
+
+# system prompt 中完全静态的指令部分，保持字节级不变以便命中前缀缓存
+_STATIC_PROMPT_SUFFIX = """
+## CORE MISSION
+1. **SOLVE ERRORS**: Identify, explain, and fix execution errors, missing connections, and incompatible types.
+2. **EXPLAIN LOGIC**: Deconstruct complex workflows into clear, step-by-step explanations of how data flows (e.g., Load Image -> VAE Encode -> KSampler -> Decode).
+
+## CAPABILITIES
+1. **Analyze Workflows**: Understand the structure, data flow, and logic of the provided JSON.
+2. **Modify Workflows**: Generate a VALID, COMPLETE JSON representation of the workflow when requested.
+3. **Active Inquiry**: If a user's request is ambiguous, ASK for clarification.
+
+## RESPONSE FORMAT
+1. **For Explanations**: Use natural language with bold key terms. Break down the flow logically (e.g., "Step 1: Input", "Step 2: Processing").
+2. **For Workflow Updates**:
+   - Output the **FULL JSON** in a Markdown code block labeled `json`.
+   - Example: ```json { ... } ```
+   - **CRITICAL**: Ensure valid JSON. NO trailing commas. NO comments inside the JSON block.
+3. **For Diagnostics / Issues**:
+   - If you find specific problems, output them in a JSON array block labeled `ISSUES_JSON`.
+   - Format: `ISSUES_JSON: [{"nodeId": 10, "severity": "error", "message": "...", "fixSuggestion": "..."}]`
+4. **For Missing Nodes**:
+   - Use a section: "SUGGESTED_ACTIONS: [Action1, Action2]".
+
+## RULES
+- **Always** validate connections.
+- **Never** break JSON structure.
+- When explaining, focus on **data flow** and **functionality**, not just node names.
+
+## FINAL OUTPUT
+At the end of your response, please provide 3 short "Related Questions" that user might want to ask next.
+Format them as a JSON array labeled `RELATED_QUESTIONS`.
+Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
+"""
+
+_STATIC_SYSTEM_PREFIXES = {
+    language: intro + _STATIC_PROMPT_SUFFIX for language, intro in _LANGUAGE_INTROS.items()
+}
+
 
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
@@ -39,6 +119,7 @@ class AgentState(TypedDict):
     action_type: Optional[str]
     action_data: Optional[Dict[str, Any]]
     workflow_analysis: Optional[Dict[str, Any]]
+    actionable_solution: Optional[Dict[str, Any]]
 
 
 class WorkflowAgent:
@@ -54,15 +135,140 @@ class WorkflowAgent:
 
     def __init__(self):
         self.workflow_graph = self._build_graph_structure()
+        # 图只编译一次，按请求绑定 checkpointer 时做浅拷贝即可
+        self.compiled_graph = self.workflow_graph.compile()
         self.db_path = settings.SQLITE_DB
         self._ensure_db_dir()
+        self._llm_cache = LLMResponseCache(maxsize=settings.LLM_CACHE_SIZE, ttl=settings.LLM_CACHE_TTL)
+        self._llm_pool: LRUCache = LRUCache(maxsize=32)
+        self._llm_http: Optional[httpx.AsyncClient] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._request_shapes: LRUCache = LRUCache(maxsize=32)
+        # 限制同时进行的 LLM 调用数；收到 429 后所有新调用一起等待冷却结束
+        self._llm_sem = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        self._llm_cooldown_until = 0.0
+        self.search_tools = SearchTools()
+        self.analyzer = workflow_analyzer
+        self.action_tools = ActionTools()
 
     def _parse_template(self, template: str, variables: Dict[str, Any]) -> str:
-        result = template
-        for key, value in variables.items():
-            placeholder = f"${key}"
-            result = result.replace(placeholder, str(value))
-        return result
+        """单次扫描替换所有 $key 占位符，未知占位符保持原样"""
+        return _TEMPLATE_RE.sub(
+            lambda m: str(variables[m.group(1)]) if m.group(1) in variables else m.group(0),
+            template
+        )
+
+    def _get_llm(self, state: AgentState):
+        """按 (provider, model, api_key, base_url) 复用已创建的 LLM 客户端"""
+        provider = state["provider"]
+        if provider == "google":
+            model = state.get("model_name", settings.DEFAULT_MODEL)
+            api_key = state.get("api_key") or settings.GOOGLE_API_KEY
+        elif provider == "openai":
+            model = state.get("model_name", "gpt-4o")
+            api_key = state.get("api_key") or settings.OPENAI_API_KEY
+        elif provider == "anthropic":
+            model = state.get("model_name", "claude-3-5-sonnet-20241022")
+            api_key = state.get("api_key") or settings.ANTHROPIC_API_KEY
+        else:
+            return None
+
+        key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+        pool_key = (provider, model, key_hash, state.get("base_url"))
+        llm = self._llm_pool.get(pool_key)
+        if llm is None:
+            llm = self._create_llm(provider, model, api_key)
+            self._llm_pool[pool_key] = llm
+        return llm
+
+    def _create_llm(self, provider: str, model: str, api_key: Optional[str]):
+        if provider == "google":
+            if ChatGoogleGenerativeAI is None:
+                raise ImportError("langchain-google-genai is required for the google provider")
+            return ChatGoogleGenerativeAI(model=model, api_key=api_key)
+        if provider == "openai":
+            if ChatOpenAI is None:
+                raise ImportError("langchain-openai is required for the openai provider")
+            if self._llm_http is None:
+                self._llm_http = httpx.AsyncClient(
+                    http2=True,
+                    limits=httpx.Limits(max_keepalive_connections=20)
+                )
+            return ChatOpenAI(model=model, api_key=api_key, http_async_client=self._llm_http)
+        if provider == "anthropic":
+            if ChatAnthropic is None:
+                raise ImportError("langchain-anthropic is required for the anthropic provider")
+            return ChatAnthropic(model=model, api_key=api_key)
+        raise ValueError(f"Unsupported provider: {provider}")
+
+    @asynccontextmanager
+    async def _llm_slot(self):
+        """占用一个 LLM 并发名额；处于 429 冷却期时先在名额外等待"""
+        delay = self._llm_cooldown_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with self._llm_sem:
+            yield
+
+    def _note_rate_limited(self, response: Optional[httpx.Response], default_delay: float = 5.0) -> float:
+        """根据 Retry-After 设置全局冷却时间，返回需要等待的秒数"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        try:
+            delay = float(retry_after) if retry_after is not None else default_delay
+        except ValueError:
+            delay = default_delay
+        delay = min(max(delay, 0.0), 60.0)
+        self._llm_cooldown_until = max(self._llm_cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def _note_if_rate_limited(self, error: BaseException) -> None:
+        """LangChain provider 抛出的 429（openai/anthropic 的 RateLimitError、Gemini 的 ResourceExhausted）同样计入全局冷却"""
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None) or getattr(error, "code", None) or getattr(response, "status_code", None)
+        if status == 429:
+            self._note_rate_limited(response if isinstance(response, httpx.Response) else None)
+
+    async def _ainvoke(self, llm, messages: List[BaseMessage], config: Optional[RunnableConfig] = None):
+        """占用一个并发名额调用 LangChain LLM，遇到限流时设置冷却"""
+        async with self._llm_slot():
+            try:
+                return await llm.ainvoke(messages, config=config)
+            except Exception as e:
+                self._note_if_rate_limited(e)
+                raise
+
+    async def _get_http(self) -> httpx.AsyncClient:
+        """Custom API 使用的长连接 HTTP 客户端，首次调用时创建"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                trust_env=False,
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+            )
+        return self._http
+
+    async def aclose(self):
+        for client in (self._http, self._llm_http):
+            if client is not None:
+                await client.aclose()
+        self._http = None
+        self._llm_http = None
+        self._llm_pool.clear()
+
+    def with_checkpointer(self, checkpointer):
+        """返回绑定了 checkpointer 的已编译图，复用预编译结果而不重新 compile"""
+        return self.compiled_graph.copy(update={"checkpointer": checkpointer})
+
+    async def run_batch_async(self, states: List[AgentState], max_concurrency: int = 8) -> List[Any]:
+        """并发执行多个互不依赖的状态（无 checkpointer），结果顺序与输入一致"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(state: AgentState):
+            async with semaphore:
+                return await self.compiled_graph.ainvoke(state)
+
+        return await asyncio.gather(*(run_one(state) for state in states), return_exceptions=True)
 
     def _ensure_db_dir(self):
         db_dir = os.path.dirname(self.db_path)
@@ -125,9 +331,6 @@ class WorkflowAgent:
         return workflow
 
     async def _classify_request(self, state: AgentState):
-        from langchain_openai import ChatOpenAI
-        from backend.config import settings
-
         messages = state["messages"]
         last_message = messages[-1] if messages else None
 
@@ -135,6 +338,11 @@ class WorkflowAgent:
             state["current_step"] = "respond"
             return state
 
+        label = self._cheap_classify(state)
+        if label:
+            logger.info(f"Rule-based classification: {label}")
+            return {"current_step": label}
+
         prompt = f"""
         Analyze the user's request and classify it into one of these categories:
         1. "search" - User is reporting an error or asking for help with a problem
@@ -149,6 +357,12 @@ class WorkflowAgent:
         Respond with only the category name.
         """
 
+        cache_model = self._cache_model_key(state)
+        cached = self._llm_cache.get(prompt, cache_model)
+        if cached:
+            logger.info(f"Classification cache hit: {cached}")
+            return {"current_step": cached}
+
         try:
             llm = None
             if state["provider"] == "custom":
@@ -158,31 +372,17 @@ class WorkflowAgent:
                 category = response.strip().lower()
                 logger.info(f"[Custom API] Classification result: {category}")
                 if category in ["search", "analyze", "respond"]:
+                    self._llm_cache.set(prompt, cache_model, category)
                     return {"current_step": category}
                 else:
                     return {"current_step": "respond"}
 
-            if state["provider"] == "google":
-                from langchain_google_genai import ChatGoogleGenerativeAI
-                llm = ChatGoogleGenerativeAI(
-                    model=state.get("model_name", settings.DEFAULT_MODEL),
-                    api_key=state.get("api_key") or settings.GOOGLE_API_KEY
-                )
-            elif state["provider"] == "openai":
-                llm = ChatOpenAI(
-                    model=state.get("model_name", "gpt-4o"),
-                    api_key=state.get("api_key") or settings.OPENAI_API_KEY
-                )
-            elif state["provider"] == "anthropic":
-                from langchain_anthropic import ChatAnthropic
-                llm = ChatAnthropic(
-                    model=state.get("model_name", "claude-3-5-sonnet-20241022"),
-                    api_key=state.get("api_key") or settings.ANTHROPIC_API_KEY
-                )
-            response = await llm.ainvoke([HumanMessage(content=prompt)])
+            llm = self._get_llm(state)
+            response = await self._ainvoke(llm, [HumanMessage(content=prompt)])
             category = response.content.strip().lower()
 
             if category in ["search", "analyze", "respond"]:
+                self._llm_cache.set(prompt, cache_model, category)
                 return {"current_step": category}
             else:
                 return {"current_step": "respond"}
@@ -190,10 +390,39 @@ class WorkflowAgent:
             logger.error(f"Classification error: {e}")
             return {"current_step": "respond"}
 
-    async def _search_solutions(self, state: AgentState) -> AgentState:
-        from backend.tools.search_tools import SearchTools
+    @staticmethod
+    def _cache_model_key(state: AgentState) -> str:
+        """响应缓存的模型维度；custom 配置再按 config id 和 base_url 区分，同名模型的不同端点不共享缓存"""
+        if state["provider"] == "custom":
+            config = state.get("config")
+            if config is not None:
+                return f"custom:{config.id}:{config.base_url}:{config.model_name}"
+        return f"{state['provider']}:{state.get('model_name')}"
+
+    def _cheap_classify(self, state: AgentState) -> Optional[str]:
+        """用简单规则判断意图，无法确定时返回 None 交给 LLM"""
+        if state.get("error_log"):
+            return "search"
+
+        content = state["messages"][-1].content
+        if not isinstance(content, str):
+            return None
+        content = content.strip()
+
+        is_search = _SEARCH_KEYWORDS_RE.search(content) is not None
+        if state.get("workflow") and _ANALYZE_KEYWORDS_RE.search(content):
+            # 以 analyze/explain 开头时明确是分析请求；两类关键字都出现时交给 LLM 判断
+            if _ANALYZE_KEYWORDS_RE.match(content):
+                return "analyze"
+            return None if is_search else "analyze"
+        if is_search:
+            return "search"
+        if len(content) < 30 and _GREETING_RE.match(content):
+            return "respond"
+        return None
 
-        search_tools = SearchTools()
+    async def _search_solutions(self, state: AgentState) -> AgentState:
+        search_tools = self.search_tools
 
         error_log = state.get("error_log", "")
         last_message = state["messages"][-1] if state["messages"] else None
@@ -201,8 +430,7 @@ class WorkflowAgent:
 
         combined_query = f"{query} {error_log}".strip()
 
-        search_results = await search_tools.search_github(combined_query)
-        web_results = await search_tools.search_web(combined_query)
+        search_results, web_results = await search_tools.search_all(combined_query)
 
         state["search_results"] = search_results + web_results
 
@@ -213,52 +441,40 @@ class WorkflowAgent:
                 state["language"]
             )
 
-        state["can_auto_fix"] = any(
-            sol.get("requires_action", False)
-            for sol in state.get("solutions", [])
+        # 只扫描一次，结果留给 _prepare_action 直接使用
+        actionable = next(
+            (sol for sol in state.get("solutions") or [] if sol.get("requires_action", False)),
+            None
         )
+        state["actionable_solution"] = actionable
+        state["can_auto_fix"] = actionable is not None
 
         return state
 
     async def _analyze_workflow(self, state: AgentState) -> AgentState:
-        from backend.tools.workflow_analyzer import WorkflowAnalyzer
-        from langchain_openai import ChatOpenAI
-        from backend.config import settings
-
-        analyzer = WorkflowAnalyzer()
+        analyzer = self.analyzer
         workflow = state.get("workflow")
 
         if workflow:
             # Construct LLM Call Function
-            async def llm_call_wrapper(prompt: str) -> str:
+            async def llm_call_wrapper(system_prompt: str, user_prompt: str) -> str:
                 try:
                     if state["provider"] == "custom":
+                        # system 放在最前面，兼容 OpenAI 的自动前缀缓存
                         response = ""
-                        async for chunk in self._call_custom_api(state["config"], [HumanMessage(content=prompt)], None, stream=True):
+                        async for chunk in self._call_custom_api(state["config"], [HumanMessage(content=user_prompt)], system_prompt, stream=True):
                             response += chunk
                         return response
                     
-                    llm = None
-                    if state["provider"] == "google":
-                        from langchain_google_genai import ChatGoogleGenerativeAI
-                        llm = ChatGoogleGenerativeAI(
-                            model=state.get("model_name", settings.DEFAULT_MODEL),
-                            api_key=state.get("api_key") or settings.GOOGLE_API_KEY
-                        )
-                    elif state["provider"] == "openai":
-                        llm = ChatOpenAI(
-                            model=state.get("model_name", "gpt-4o"),
-                            api_key=state.get("api_key") or settings.OPENAI_API_KEY
-                        )
-                    elif state["provider"] == "anthropic":
-                        from langchain_anthropic import ChatAnthropic
-                        llm = ChatAnthropic(
-                            model=state.get("model_name", "claude-3-5-sonnet-20241022"),
-                            api_key=state.get("api_key") or settings.ANTHROPIC_API_KEY
-                        )
-                    
+                    llm = self._get_llm(state)
                     if llm:
-                        res = await llm.ainvoke([HumanMessage(content=prompt)])
+                        if state["provider"] == "anthropic":
+                            system_message = SystemMessage(content=[
+                                {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+                            ])
+                        else:
+                            system_message = SystemMessage(content=system_prompt)
+                        res = await self._ainvoke(llm, [system_message, HumanMessage(content=user_prompt)])
                         return res.content
                     return ""
                 except Exception as e:
@@ -269,56 +485,38 @@ class WorkflowAgent:
             analysis = await analyzer.analyze_workflow_with_llm(
                 workflow, 
                 llm_call_wrapper, 
-                state["language"]
+                state["language"],
+                model_key=self._cache_model_key(state)
             )
             state["workflow_analysis"] = analysis
 
         return state
 
     async def _generate_response(self, state: AgentState,config: RunnableConfig):
-        from langchain_openai import ChatOpenAI
-        from backend.config import settings
-
-        system_prompt = self._get_system_prompt(state)
-        system_prompt += """
-## CORE MISSION
-1. **SOLVE ERRORS**: Identify, explain, and fix execution errors, missing connections, and incompatible types.
-2. **EXPLAIN LOGIC**: Deconstruct complex workflows into clear, step-by-step explanations of how data flows (e.g., Load Image -> VAE Encode -> KSampler -> Decode).
-
-## CAPABILITIES
-1. **Analyze Workflows**: Understand the structure, data flow, and logic of the provided JSON.
-2. **Modify Workflows**: Generate a VALID, COMPLETE JSON representation of the workflow when requested.
-3. **Active Inquiry**: If a user's request is ambiguous, ASK for clarification.
-
-## RESPONSE FORMAT
-1. **For Explanations**: Use natural language with bold key terms. Break down the flow logically (e.g., "Step 1: Input", "Step 2: Processing").
-2. **For Workflow Updates**:
-   - Output the **FULL JSON** in a Markdown code block labeled \`json\`.
-   - Example: \`\`\`json { ... } \`\`\`
-   - **CRITICAL**: Ensure valid JSON. NO trailing commas. NO comments inside the JSON block.
-3. **For Diagnostics / Issues**:
-   - If you find specific problems, output them in a JSON array block labeled \`ISSUES_JSON\`.
-   - Format: \`ISSUES_JSON: [{"nodeId": 10, "severity": "error", "message": "...", "fixSuggestion": "..."}]\`
-4. **For Missing Nodes**:
-   - Use a section: "SUGGESTED_ACTIONS: [Action1, Action2]".
+        static_prompt = self._static_system_prefix(state.get("language", "en"))
+        dynamic_prompt = self._dynamic_suffix(state)
+        system_prompt = f"{static_prompt}\n\n{dynamic_prompt}" if dynamic_prompt else static_prompt
+
+        # 按 token 预算截断历史，始终保留最后一条（当前用户输入）
+        recent_messages = truncate_messages(
+            state["messages"],
+            settings.MAX_HISTORY_TOKENS,
+            state.get("model_name")
+        )
 
-## RULES
-- **Always** validate connections.
-- **Never** break JSON structure.
-- When explaining, focus on **data flow** and **functionality**, not just node names.
+        # 相同的 system prompt + 历史消息直接复用上次的回复，跳过 LLM 调用
+        cache_prompt = [system_prompt] + [[getattr(m, "type", ""), m.content] for m in recent_messages]
+        cache_model = self._cache_model_key(state)
+        cached = self._llm_cache.get(cache_prompt, cache_model)
+        if cached:
+            logger.info("Response cache hit")
+            await adispatch_custom_event(
+                "custom_chunk",
+                {"chunk": cached},
+                config=config
+            )
+            return {"messages": [AIMessage(content=cached)]}
 
-## FINAL OUTPUT
-At the end of your response, please provide 3 short "Related Questions" that user might want to ask next.
-Format them as a JSON array labeled `RELATED_QUESTIONS`.
-Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
-`;
-        """
-        
-        # Limit history to last 10 messages
-        all_messages = state["messages"]
-        # Ensure we always include the last message (current user input)
-        recent_messages = all_messages[-10:] if len(all_messages) > 10 else all_messages
-        
         try:
             llm = None
             if state["provider"] == "custom":
@@ -331,57 +529,44 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
                     )
                     full_content += chunk
                 logger.info(f"Response: {full_content}")
-                
+                self._llm_cache.set(cache_prompt, cache_model, full_content)
+
                 response = AIMessage(content=full_content)
                 return {"messages": [response]}
 
-            if state["provider"] == "google":
-                from langchain_google_genai import ChatGoogleGenerativeAI
-                llm = ChatGoogleGenerativeAI(
-                    model=state.get("model_name", settings.DEFAULT_MODEL),
-                    api_key=state.get("api_key") or settings.GOOGLE_API_KEY
-                )
-            elif state["provider"] == "openai":
-                llm = ChatOpenAI(
-                    model=state.get("model_name", "gpt-4o"),
-                    api_key=state.get("api_key") or settings.OPENAI_API_KEY
-                )
-            elif state["provider"] == "anthropic":
-                from langchain_anthropic import ChatAnthropic
-                llm = ChatAnthropic(
-                    model=state.get("model_name", "claude-3-5-sonnet-20241022"),
-                    api_key=state.get("api_key") or settings.ANTHROPIC_API_KEY
-                )
+            llm = self._get_llm(state)
 
             # Construct messages with System Prompt + Recent History
-            messages = [SystemMessage(content=system_prompt)] + recent_messages
+            if state["provider"] == "anthropic":
+                # 静态前缀单独成块并打上缓存断点，动态内容放在断点之后
+                system_content = [{"type": "text", "text": static_prompt, "cache_control": {"type": "ephemeral"}}]
+                if dynamic_prompt:
+                    system_content.append({"type": "text", "text": dynamic_prompt})
+                system_message = SystemMessage(content=system_content)
+            else:
+                system_message = SystemMessage(content=system_prompt)
+            messages = [system_message] + recent_messages
 
-            response = await llm.ainvoke(messages, config=config)
+            response = await self._ainvoke(llm, messages, config=config)
+            if isinstance(response.content, str):
+                self._llm_cache.set(cache_prompt, cache_model, response.content)
 
             return {"messages": [response]}
         except Exception as e:
             return {"messages": [AIMessage(content=f"Error generating response: {str(e)}")]}
 
     async def _prepare_action(self, state: AgentState) -> AgentState:
-        solutions = state.get("solutions", [])
-
-        if solutions:
-            actionable_solution = next(
-                (sol for sol in solutions if sol.get("requires_action", False)),
-                None
-            )
+        actionable_solution = state.get("actionable_solution")
 
-            if actionable_solution:
-                state["requires_user_confirmation"] = True
-                state["action_type"] = actionable_solution.get("action_type")
-                state["action_data"] = actionable_solution.get("action_data", {})
+        if actionable_solution:
+            state["requires_user_confirmation"] = True
+            state["action_type"] = actionable_solution.get("action_type")
+            state["action_data"] = actionable_solution.get("action_data", {})
 
         return state
 
     async def _execute_action(self, state: AgentState) -> AgentState:
-        from backend.tools.action_tools import ActionTools
-
-        action_tools = ActionTools()
+        action_tools = self.action_tools
 
         if state.get("action_type") and state.get("action_data"):
             result = await action_tools.execute_action(
@@ -409,36 +594,44 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
             return "respond"
         return "execute"
 
-    def _get_system_prompt(self, state: AgentState) -> str:
-        language = state.get("language", "en")
-
-        language_map = {
-            "en": "You are ComfyUI Workflow Agent, an expert assistant specialized in ComfyUI workflows.",
-            "zh": "你是 ComfyUI 工作流助手，专门帮助用户解决 ComfyUI 工作流问题。",
-            "ja": "あなたは ComfyUI ワークフローエージェントです。",
-            "ko": "당신은 ComfyUI 워크플로우 에이전트입니다."
-        }
+    def _static_system_prefix(self, language: str) -> str:
+        """固定不变的指令部分，放在 system prompt 最前面以命中 provider 的前缀缓存"""
+        return _STATIC_SYSTEM_PREFIXES.get(language, _STATIC_SYSTEM_PREFIXES["en"])
 
-        base_prompt = language_map.get(language, language_map["en"])
+    def _dynamic_suffix(self, state: AgentState) -> str:
+        """每轮都会变化的上下文（搜索结果、方案、分析），追加在静态前缀之后"""
+        parts = []
 
         if state.get("search_results"):
-            base_prompt += f"\n\nSearch Results:\n{state['search_results']}"
+            parts.append(f"Search Results:\n{self._canonical_json(state['search_results'])}")
 
         if state.get("solutions"):
-            base_prompt += f"\n\nSolutions:\n{state['solutions']}"
+            parts.append(f"Solutions:\n{self._canonical_json(state['solutions'])}")
 
         if state.get("workflow_analysis"):
-            base_prompt += f"\n\nWorkflow Analysis:\n{state['workflow_analysis']}"
+            parts.append(f"Workflow Analysis:\n{self._canonical_json(state['workflow_analysis'])}")
 
         if state.get("requires_user_confirmation"):
-            base_prompt += "\n\nIMPORTANT: Ask the user if they want to execute the suggested action."
-
-        return base_prompt
+            parts.append("IMPORTANT: Ask the user if they want to execute the suggested action.")
+
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _canonical_json(value: Any) -> str:
+        return json.dumps(
+            value,
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=lambda o: o.model_dump() if hasattr(o, "model_dump") else str(o)
+        )
 
-    async def _call_custom_api(self, config: APIProviderConfig, messages: List[Any], system_prompt,stream: bool = False,
-                               max_retries: int = 3, retry_delay: float = 2.0) -> AsyncGenerator[str, None]:
-        if not config.custom_config:
-            raise ValueError("Custom config is required for custom provider")
+    def _get_request_shape(self, config: APIProviderConfig) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """按配置缓存解析好的 url / headers / body 模板（不含 messages），配置更新后自动失效"""
+        cache_key = (config.id, config.updated_at)
+        shape = self._request_shapes.get(cache_key)
+        if shape is not None:
+            return shape
 
         custom_config = config.custom_config
         endpoint = custom_config.get("endpoint", "/v1/chat/completions")
@@ -446,31 +639,9 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
                                              '{"Content-Type": "application/json", "Authorization": "Bearer $apiKey"}')
         body_template = custom_config.get("body", '{"model": "$model", "messages": $messages, "temperature": 0.5}')
 
-        logger.info(f"[Custom API] Calling custom API with config: {config.name}")
-        logger.info(f"[Custom API] Base URL: {config.base_url}")
-        logger.info(f"[Custom API] Endpoint: {endpoint}")
-        logger.info(f"[Custom API] Model: {config.model_name}")
-        logger.info(f"[Custom API] Stream: {stream}")
-
-        messages_list = []
-        if system_prompt:
-            messages_list.append({"role": "system", "content": system_prompt})
-        for msg in messages:
-            if isinstance(msg, dict):
-                if msg.get("role") == "system" and system_prompt:
-                    continue
-                messages_list.append(msg)
-            elif isinstance(msg, HumanMessage):
-                messages_list.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                messages_list.append({"role": "assistant", "content": msg.content})
-
-        logger.info(f"[Custom API] Final messages list: {json.dumps(messages_list, ensure_ascii=False)}")
-
         variables = {
             "apiKey": config.api_key or "",
-            "model": config.model_name or "",
-            "messages": json.dumps(messages_list)
+            "model": config.model_name or ""
         }
 
         url = f"{config.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
@@ -483,35 +654,66 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
             logger.error(f"[Custom API] Invalid headers JSON: {headers_str}")
             raise ValueError(f"Invalid headers JSON: {headers_str}")
 
-        logger.info(f"[Custom API] Headers: {headers}")
+        # messages 不参与模板替换，解析后再直接塞入 body
         temp_template = body_template.replace('"$messages"', 'null').replace('$messages', 'null')
-        variables_without_list = {k: v for k, v in variables.items() if k != 'messages'}
-        body_str = self._parse_template(temp_template, variables_without_list)
+        body_str = self._parse_template(temp_template, variables)
         try:
             body = json.loads(body_str)
-            body['messages'] = messages_list
         except json.JSONDecodeError:
             logger.error(f"[Custom API] Invalid body JSON: {body_str}")
             raise ValueError(f"Invalid body JSON: {body_str}")
 
-        logger.info(f"[Custom API] Request body: {json.dumps(body, ensure_ascii=False)}")
-        logger.info(
-            f"[Custom API] Full request - URL: {url}, Headers: {headers}, Body: {json.dumps(body, ensure_ascii=False)}")
+        shape = (url, headers, body)
+        self._request_shapes[cache_key] = shape
+        return shape
+
+    async def _call_custom_api(self, config: APIProviderConfig, messages: List[Any], system_prompt,stream: bool = False,
+                               max_retries: int = 3, retry_delay: float = 2.0) -> AsyncGenerator[str, None]:
+        if not config.custom_config:
+            raise ValueError("Custom config is required for custom provider")
+
+        logger.info(f"[Custom API] Calling custom API with config: {config.name}")
+        logger.info(f"[Custom API] Model: {config.model_name}")
+        logger.info(f"[Custom API] Stream: {stream}")
+
+        messages_list = []
+        if system_prompt:
+            messages_list.append({"role": "system", "content": system_prompt})
+        for msg in messages:
+            if isinstance(msg, dict):
+                if msg.get("role") == "system" and system_prompt:
+                    continue
+                messages_list.append(msg)
+            elif isinstance(msg, HumanMessage):
+                messages_list.append({"role": "user", "content": msg.content})
+            elif isinstance(msg, AIMessage):
+                messages_list.append({"role": "assistant", "content": msg.content})
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Custom API] Final messages list: %s", orjson.dumps(messages_list).decode())
+
+        url, headers, body_base = self._get_request_shape(config)
+        body = dict(body_base)
+        body["messages"] = messages_list
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Custom API] Request body: %s", orjson.dumps(body).decode())
 
         retry_count = 0
         last_error = None
 
         while retry_count < max_retries:
             try:
-                async with httpx.AsyncClient(timeout=60.0, trust_env=False) as client:
+                # 并发名额按单次请求占用，重试前的退避等待不占名额
+                async with self._llm_slot():
+                    client = await self._get_http()
                     if stream:
                         logger.info("[Custom API] Starting streaming request...")
 
-                        req = client.build_request("POST", url, json=body, headers=headers)
                         async with client.stream(method="POST", url=url, json=body, headers=headers) as response:
                             logger.info(f"[Custom API] Response status: {response.status_code}")
 
-                            if response.status_code >= 500:
+                            if response.status_code >= 500 or response.status_code == 429:
                                 raise httpx.HTTPStatusError(
                                     f"Server error {response.status_code}",
                                     request=None,
@@ -519,36 +721,32 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
                                 )
                             response.raise_for_status()
 
-                            full_text = ""
                             chunk_count = 0
-                            async for line in response.aiter_lines():
-                                line = line.strip()
-                                if not line: continue
-
-                                if line.startswith('data: '):
-                                    data_str = line[6:]
-                                    if data_str == '[DONE]':
-                                        logger.info(f"[Custom API] Streaming completed.")
-                                        break
-
-                                    try:
-                                        data = json.loads(data_str)
-                                        # 兼容不同厂商的格式，这里主要适配 OpenAI 格式
-                                        if 'choices' in data and len(data['choices']) > 0:
-                                            delta = data['choices'][0].get('delta', {})
-                                            content = delta.get('content', '')
-                                            if content:
-                                                full_text += content
-                                                chunk_count += 1
-                                                yield content
-                                    except json.JSONDecodeError:
-                                        continue
+                            debug = logger.isEnabledFor(logging.DEBUG)
+                            async for payload in iter_sse_data(response):
+                                if payload == b"[DONE]":
+                                    logger.info(f"[Custom API] Streaming completed.")
+                                    break
+
+                                try:
+                                    data = orjson.loads(payload)
+                                except orjson.JSONDecodeError:
+                                    continue
+                                # 兼容不同厂商的格式，这里主要适配 OpenAI 格式
+                                choices = data.get("choices") if isinstance(data, dict) else None
+                                if choices:
+                                    content = choices[0].get("delta", {}).get("content")
+                                    if content:
+                                        chunk_count += 1
+                                        if debug:
+                                            logger.debug("[Custom API] Chunk %d: %s", chunk_count, content)
+                                        yield content
                     else:
                         logger.info("[Custom API] Starting non-streaming request...")
                         response = await client.post(url, json=body, headers=headers)
                         logger.info(f"[Custom API] Response status: {response.status_code}")
 
-                        if response.status_code >= 500:
+                        if response.status_code >= 500 or response.status_code == 429:
                             raise httpx.HTTPStatusError(
                                 f"Server error {response.status_code}",
                                 request=None,
@@ -557,8 +755,9 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
 
                         response.raise_for_status()
 
-                        data = response.json()
-                        logger.info(f"[Custom API] Response data: {json.dumps(data, ensure_ascii=False)}")
+                        data = orjson.loads(response.content)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("[Custom API] Response data: %s", response.text)
 
                         if 'choices' in data and len(data['choices']) > 0:
                             content = data['choices'][0].get('message', {}).get('content', '')
@@ -567,11 +766,17 @@ Example: `RELATED_QUESTIONS: ["Question 1?", "Question 2?"]`
                         else:
                             logger.warning(f"[Custom API] Unexpected response format: {data}")
                             yield str(data)
-                return
+                    return
 
             except httpx.HTTPStatusError as e:
                 last_error = e
                 retry_count += 1
+                if e.response is not None and e.response.status_code == 429 and retry_count < max_retries:
+                    delay = self._note_rate_limited(e.response)
+                    logger.warning(
+                        f"[Custom API] Rate limited, retry {retry_count}/{max_retries} in {delay}s...")
+                    await asyncio.sleep(delay)
+                    continue
                 if e.response and e.response.status_code >= 500 and retry_count <= max_retries:
                     logger.warning(
                         f"[Custom API] Server error {e.response.status_code}, retry {retry_count}/{max_retries} in {retry_delay}s...")
@@ -1,5 +1,7 @@
 import os
-from typing import Optional
+import threading
+from functools import lru_cache
+from typing import Any, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -18,6 +20,17 @@ class Settings(BaseSettings):
     REQUEST_TIMEOUT: int = 30
     
     ENABLE_STREAMING: bool = True
+
+    LLM_CACHE_SIZE: int = 2000
+    LLM_CACHE_TTL: int = 3600
+
+    MAX_HISTORY_TOKENS: int = 6000
+
+    LLM_MAX_CONCURRENCY: int = 8
+
+    # start_backend.py 的进程参数：开发时设 DEV_RELOAD=1 开启热重载
+    DEV_RELOAD: bool = False
+    WORKERS: int = 1
     
     _BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     CHECKPOINT_DIR: str = os.path.join(_BASE_DIR, "checkpoints")
@@ -30,17 +43,47 @@ class Settings(BaseSettings):
         case_sensitive = True
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """全局唯一的 Settings 实例，.env 只解析一次"""
+    return Settings()
+
+
+settings = get_settings()
+
+
+_UNSET = object()
+# (token 文件 mtime, 解析出的 token)；文件被其他进程改写时 mtime 变化即失效
+_github_token_cache: Any = _UNSET
+_github_token_lock = threading.Lock()
+
+
+def _github_token_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
 
 def get_github_token() -> Optional[str]:
+    global _github_token_cache
     from backend.services.config_service import config_service
-    
-    token = config_service.get_github_token()
-    if token:
-        return token
-    
-    return settings.GITHUB_TOKEN
+
+    mtime = _github_token_mtime(config_service.github_token_file)
+    cached = _github_token_cache
+    if cached is not _UNSET and cached[0] == mtime:
+        return cached[1]
+
+    with _github_token_lock:
+        token = config_service.get_github_token() or settings.GITHUB_TOKEN
+        _github_token_cache = (mtime, token)
+    return token
+
+
+def invalidate_github_token_cache() -> None:
+    global _github_token_cache
+    with _github_token_lock:
+        _github_token_cache = _UNSET
 
 
 def ensure_directories():
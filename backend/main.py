@@ -2,6 +2,7 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from backend.config import settings
+from backend.responses import ORJSONResponse
 from backend.routes import chat, workflow, actions, config
 import os
 import logging
@@ -24,8 +25,24 @@ async def lifespan(app: FastAPI):
     logger.info(f"Database directory: {settings.DATABASE_DIR}")
     from backend.config import ensure_directories
     ensure_directories()
+
+    from backend.services.chat_service import ChatService
+    from backend.services.workflow_service import WorkflowService
+    from backend.services.action_service import ActionService
+    app.state.chat_service = ChatService()
+    app.state.workflow_service = WorkflowService()
+    app.state.action_service = ActionService()
     logger.info("Application startup complete")
     yield
+    from backend.services.config_service import config_service
+    config_service.flush()
+    await app.state.chat_service.aclose()
+    from backend.agent.workflow_agent import workflow_agent
+    await workflow_agent.aclose()
+    from backend.action_history import action_history
+    await action_history.aclose()
+    from backend.mcp.http_client import aclose_github_client
+    await aclose_github_client()
     logger.info("Application shutdown")
 
 
@@ -33,6 +50,7 @@ app = FastAPI(
     title="ComfyUI Workflow Agent API",
     description="Backend API for ComfyUI Workflow Agent with LangGraph and FastMCP",
     version="1.2.1",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -0,0 +1,24 @@
+from typing import Optional
+
+import httpx
+
+_github_client: Optional[httpx.AsyncClient] = None
+
+
+def get_github_client() -> httpx.AsyncClient:
+    """MCP 工具共用的 GitHub HTTP 客户端，首次调用时创建"""
+    global _github_client
+    if _github_client is None or _github_client.is_closed:
+        _github_client = httpx.AsyncClient(
+            timeout=30,
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _github_client
+
+
+async def aclose_github_client() -> None:
+    global _github_client
+    if _github_client is not None:
+        await _github_client.aclose()
+        _github_client = None
@@ -0,0 +1,16 @@
+from functools import lru_cache
+from typing import Optional
+
+from backend.config import settings
+
+
+@lru_cache(maxsize=4)
+def _create_gemini(model: str, api_key: Optional[str]):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model=model, api_key=api_key)
+
+
+def get_gemini(model: str):
+    """MCP 工具和 SearchTools 共用的 Gemini 客户端；每次调用读取当前的 GOOGLE_API_KEY，key 轮换后自然换新实例"""
+    return _create_gemini(model, settings.GOOGLE_API_KEY)
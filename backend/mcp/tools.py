@@ -1,11 +1,60 @@
+from collections import OrderedDict
 from fastmcp import FastMCP
+import hashlib
 from typing import Dict, Any, List, Optional
-import httpx
-import json
+import re
+
+import orjson
+
+from backend.config import get_github_token
+from backend.mcp.http_client import get_github_client
+from backend.mcp.llm_client import get_gemini
+from backend.tools.workflow_analyzer import workflow_analyzer
+from backend.tools.action_tools import ActionTools
 
 
 mcp = FastMCP("ComfyUI Workflow Agent")
 
+_analyzer = workflow_analyzer
+_action_tools = ActionTools()
+
+_GH_SEARCH_URL = "https://api.github.com/search/issues"
+_GH_STATIC_PARAMS = (("sort", "updated"), ("order", "desc"))
+
+# 从 LLM 输出中提取 JSON 对象 / 数组
+_JSON_OBJ_RE = re.compile(r'\{.*\}', re.DOTALL)
+_JSON_ARR_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+
+def _dump(obj: Any) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str).decode()
+
+
+_WORKFLOW_CACHE_SIZE = 32
+_workflow_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+
+
+def _parse_workflow(workflow_json: str) -> Dict[str, Any]:
+    """按内容哈希缓存解析结果，同一工作流连续调用多个工具时只解析一次（结果只读）"""
+    key = hashlib.blake2b(workflow_json.encode("utf-8"), digest_size=16).digest()
+    workflow = _workflow_cache.get(key)
+    if workflow is None:
+        workflow = orjson.loads(workflow_json)
+        _workflow_cache[key] = workflow
+        if len(_workflow_cache) > _WORKFLOW_CACHE_SIZE:
+            _workflow_cache.popitem(last=False)
+    else:
+        _workflow_cache.move_to_end(key)
+    return workflow
+
+
+def _search_json(pattern: re.Pattern, opener: str, text: str):
+    """没有起始括号时直接返回，不进入正则扫描"""
+    start = text.find(opener)
+    if start == -1:
+        return None
+    return pattern.search(text, start)
+
 
 @mcp.tool()
 async def search_github_issues(query: str, limit: int = 10) -> str:
@@ -19,41 +68,34 @@ async def search_github_issues(query: str, limit: int = 10) -> str:
         JSON string containing search results
     """
     try:
-        from backend.config import settings, get_github_token
-        
         headers = {}
         github_token = get_github_token()
         if github_token:
             headers["Authorization"] = f"token {github_token}"
         
-        search_query = f"{query} comfyui error issue"
-        url = f"https://api.github.com/search/issues"
-        params = {
-            "q": search_query,
-            "per_page": limit,
-            "sort": "updated",
-            "order": "desc"
-        }
-        
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.get(url, headers=headers, params=params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                results = []
-                for item in data.get("items", []):
-                    results.append({
-                        "title": item.get("title", ""),
-                        "url": item.get("html_url", ""),
-                        "body": item.get("body", "")[:500],
-                        "state": item.get("state", ""),
-                        "comments": item.get("comments", 0)
-                    })
-                return json.dumps(results, ensure_ascii=False, indent=2)
-            else:
-                return json.dumps({"error": f"GitHub API returned {response.status_code}"})
+        params = _GH_STATIC_PARAMS + (("q", query + " comfyui error issue"), ("per_page", limit))
+        
+        client = get_github_client()
+        response = await client.get(_GH_SEARCH_URL, headers=headers, params=params)
+        
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            results = [
+                {
+                    "title": item.get("title", ""),
+                    "url": item.get("html_url", ""),
+                    # issue 没有正文时 GitHub 返回 null
+                    "body": (item.get("body") or "")[:500],
+                    "state": item.get("state", ""),
+                    "comments": item.get("comments", 0)
+                }
+                for item in data.get("items", ())
+            ]
+            return _dump(results)
+        else:
+            return _dump({"error": f"GitHub API returned {response.status_code}"})
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -67,14 +109,9 @@ async def search_web(query: str) -> str:
         JSON string containing search results
     """
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
         from langchain_core.messages import HumanMessage
-        from backend.config import settings
         
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp",
-            api_key=settings.GOOGLE_API_KEY
-        )
+        llm = get_gemini("gemini-2.0-flash-exp")
         
         prompt = f"""
         Search the web for solutions to this ComfyUI error/problem:
@@ -91,14 +128,13 @@ async def search_web(query: str) -> str:
         
         response = await llm.ainvoke([HumanMessage(content=prompt)])
         
-        import re
-        json_match = re.search(r'\[.*\]', response.content, re.DOTALL)
+        json_match = _search_json(_JSON_ARR_RE, "[", response.content)
         if json_match:
             return json_match.group()
         
-        return json.dumps([])
+        return _dump([])
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -112,22 +148,20 @@ async def analyze_workflow(workflow_json: str) -> str:
         JSON string containing analysis results
     """
     try:
-        from backend.tools.workflow_analyzer import WorkflowAnalyzer
-        
-        analyzer = WorkflowAnalyzer()
-        workflow = json.loads(workflow_json)
+        analyzer = _analyzer
+        workflow = _parse_workflow(workflow_json)
         
         analysis = await analyzer.analyze_workflow(workflow, "en")
         
-        return json.dumps({
+        return _dump({
             "summary": analysis.summary,
             "data_flow": analysis.data_flow,
             "key_nodes": analysis.key_nodes,
             "issues": [issue.model_dump() for issue in analysis.issues],
             "suggestions": analysis.suggestions
-        }, ensure_ascii=False, indent=2)
+        })
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -141,23 +175,17 @@ async def detect_workflow_issues(workflow_json: str) -> str:
         JSON string containing detected issues
     """
     try:
-        from backend.tools.workflow_analyzer import WorkflowAnalyzer
-        
-        analyzer = WorkflowAnalyzer()
-        workflow = json.loads(workflow_json)
+        analyzer = _analyzer
+        workflow = _parse_workflow(workflow_json)
         
         nodes = workflow.get("nodes", [])
         links = workflow.get("links", [])
         
-        issues = await analyzer._detect_issues(nodes, links)
+        issues = analyzer._detect_issues(nodes, links)
         
-        return json.dumps(
-            [issue.model_dump() for issue in issues],
-            ensure_ascii=False,
-            indent=2
-        )
+        return _dump([issue.model_dump() for issue in issues])
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -171,22 +199,20 @@ async def get_workflow_data_flow(workflow_json: str) -> str:
         JSON string containing data flow information
     """
     try:
-        from backend.tools.workflow_analyzer import WorkflowAnalyzer
-        
-        analyzer = WorkflowAnalyzer()
-        workflow = json.loads(workflow_json)
+        analyzer = _analyzer
+        workflow = _parse_workflow(workflow_json)
         
         nodes = workflow.get("nodes", [])
         links = workflow.get("links", [])
         
         data_flow = analyzer._analyze_data_flow(nodes, links)
         
-        return json.dumps({
+        return _dump({
             "data_flow": data_flow,
             "total_connections": len(data_flow)
-        }, ensure_ascii=False, indent=2)
+        })
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -206,16 +232,14 @@ async def execute_workflow_action(
         JSON string containing action result
     """
     try:
-        from backend.tools.action_tools import ActionTools
-        
-        action_tools = ActionTools()
-        data = json.loads(action_data)
+        action_tools = _action_tools
+        data = orjson.loads(action_data)
         
         result = await action_tools.execute_action(action_type, data, session_id)
         
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return _dump(result)
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -229,14 +253,12 @@ async def undo_workflow_action(action_id: str) -> str:
         JSON string containing undo result
     """
     try:
-        from backend.tools.action_tools import ActionTools
-        
-        action_tools = ActionTools()
+        action_tools = _action_tools
         result = await action_tools.undo_action(action_id)
         
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return _dump(result)
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -252,11 +274,98 @@ async def get_action_history(session_id: str) -> str:
     try:
         from backend.action_history import action_history
         
-        actions = action_history.get_session_actions(session_id)
+        actions = await action_history.get_session_actions(session_id)
         
-        return json.dumps(actions, ensure_ascii=False, indent=2)
+        return _dump([action.to_dict() for action in actions])
+    except Exception as e:
+        return _dump({"error": str(e)})
+
+
+_ERROR_ANALYSIS_CACHE_SIZE = 32
+# error_log 哈希 -> (workflow 哈希, 合并分析结果)；同一日志先后调用 parse_error_log / suggest_fixes 只请求一次 LLM
+_error_analysis_cache: "OrderedDict[bytes, Any]" = OrderedDict()
+
+
+def _digest(text: Optional[str]) -> bytes:
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).digest()
+
+
+async def _analyze_error(
+        error_log: str,
+        workflow_json: Optional[str] = None,
+        ignore_workflow: bool = False
+) -> Dict[str, Any]:
+    """一次 LLM 调用同时完成错误解析和修复建议，结果按日志缓存
+
+    workflow 也是 prompt 的一部分，只有 ignore_workflow=True（仅取 parsed_error）时才复用其他 workflow 的缓存结果。
+    """
+    key = _digest(error_log)
+    workflow_key = _digest(workflow_json)
+    cached = _error_analysis_cache.get(key)
+    if cached is not None and (ignore_workflow or cached[0] == workflow_key):
+        _error_analysis_cache.move_to_end(key)
+        return cached[1]
+
+    from langchain_core.messages import HumanMessage
+
+    llm = get_gemini("gemini-2.0-flash-exp")
+
+    workflow_info = ""
+    if workflow_json:
+        workflow_info = f"\n\nWorkflow:\n{workflow_json}"
+
+    prompt = f"""
+    Analyze this ComfyUI error log, extract the error details and suggest fixes.
+
+    Error Log:
+    {error_log}
+    {workflow_info}
+
+    Return in JSON format with:
+    - parsed_error: Object with:
+      - error_type: Error type/category
+      - error_message: Error message
+      - node_id: Node ID (if applicable)
+      - stack_trace: Stack trace key points
+      - possible_causes: Possible causes
+    - error_type: Type of error
+    - summary: Brief summary
+    - solutions: Array of solution objects with:
+      - description: Description of the solution
+      - steps: Array of steps to implement
+      - requires_action: Boolean if it can be auto-fixed
+      - action_type: Type of action if auto-fixable
+      - action_data: Data needed for the action
+    """
+
+    response = await llm.ainvoke([HumanMessage(content=prompt)])
+
+    json_match = _search_json(_JSON_OBJ_RE, "{", response.content)
+    if not json_match:
+        raise ValueError("Could not parse LLM response")
+    data = orjson.loads(json_match.group())
+
+    _error_analysis_cache[key] = (workflow_key, data)
+    if len(_error_analysis_cache) > _ERROR_ANALYSIS_CACHE_SIZE:
+        _error_analysis_cache.popitem(last=False)
+    return data
+
+
+@mcp.tool()
+async def analyze_and_fix(error_log: str, workflow_json: Optional[str] = None) -> str:
+    """Parse a ComfyUI error log and suggest fixes in a single pass.
+    
+    Args:
+        error_log: The error log text
+        workflow_json: Optional JSON string of the workflow
+    
+    Returns:
+        JSON string containing parsed_error, error_type, summary and solutions
+    """
+    try:
+        return _dump(await _analyze_error(error_log, workflow_json))
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -270,39 +379,14 @@ async def parse_error_log(error_log: str) -> str:
         JSON string containing parsed error information
     """
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        from langchain_core.messages import HumanMessage
-        from backend.config import settings
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp",
-            api_key=settings.GOOGLE_API_KEY
-        )
-        
-        prompt = f"""
-        Analyze this ComfyUI error log and extract:
-        1. Error type/category
-        2. Error message
-        3. Node ID (if applicable)
-        4. Stack trace key points
-        5. Possible causes
-        
-        Error Log:
-        {error_log}
-        
-        Return in JSON format.
-        """
+        data = await _analyze_error(error_log, ignore_workflow=True)
+        parsed_error = data.get("parsed_error")
+        if parsed_error:
+            return _dump(parsed_error)
         
-        response = await llm.ainvoke([HumanMessage(content=prompt)])
-        
-        import re
-        json_match = re.search(r'\{.*\}', response.content, re.DOTALL)
-        if json_match:
-            return json_match.group()
-        
-        return json.dumps({"error": "Could not parse error log"})
+        return _dump({"error": "Could not parse error log"})
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 @mcp.tool()
@@ -317,47 +401,17 @@ async def suggest_fixes(error_log: str, workflow_json: Optional[str] = None) ->
         JSON string containing suggested fixes
     """
     try:
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        from langchain_core.messages import HumanMessage
-        from backend.config import settings
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp",
-            api_key=settings.GOOGLE_API_KEY
-        )
-        
-        workflow_info = ""
-        if workflow_json:
-            workflow_info = f"\n\nWorkflow:\n{workflow_json}"
-        
-        prompt = f"""
-        Analyze this ComfyUI error and suggest fixes.
-        
-        Error Log:
-        {error_log}
-        {workflow_info}
-        
-        Return in JSON format with:
-        - error_type: Type of error
-        - summary: Brief summary
-        - solutions: Array of solution objects with:
-          - description: Description of the solution
-          - steps: Array of steps to implement
-          - requires_action: Boolean if it can be auto-fixed
-          - action_type: Type of action if auto-fixable
-          - action_data: Data needed for the action
-        """
-        
-        response = await llm.ainvoke([HumanMessage(content=prompt)])
-        
-        import re
-        json_match = re.search(r'\{.*\}', response.content, re.DOTALL)
-        if json_match:
-            return json_match.group()
-        
-        return json.dumps({"error": "Could not generate fixes"})
+        data = await _analyze_error(error_log, workflow_json)
+        if "solutions" in data:
+            return _dump({
+                "error_type": data.get("error_type"),
+                "summary": data.get("summary"),
+                "solutions": data["solutions"]
+            })
+        
+        return _dump({"error": "Could not generate fixes"})
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return _dump({"error": str(e)})
 
 
 if __name__ == "__main__":
@@ -1,5 +1,5 @@
 from typing import Any, Dict, List, Optional, Union
-from pydantic import BaseModel, Field,validator, field_validator
+from pydantic import BaseModel, Field, field_validator
 from enum import Enum
 
 
@@ -40,7 +40,7 @@ class ComfyNode(BaseModel):
     id: int
     type: str
     pos: List[float]
-    size: Union[Dict[str, Any], List[float]]
+    size: List[float]
     flags: Dict[str, Any] = {}
     order: int
     mode: int
@@ -51,6 +51,14 @@ class ComfyNode(BaseModel):
     color: Optional[str] = None
     bgcolor: Optional[str] = None
 
+    @field_validator('size', mode='before')
+    @classmethod
+    def _coerce_size(cls, v):
+        # 旧版工作流以 {"0": w, "1": h} 存储尺寸
+        if isinstance(v, dict):
+            return [v.get('0', 0), v.get('1', 0)]
+        return v
+
 
 class ComfyLink(BaseModel):
     id: int
@@ -58,20 +66,20 @@ class ComfyLink(BaseModel):
     origin_slot: int
     target_id: int
     target_slot: int
-    type: str
+    # 标准导出里是 "MODEL" 这样的类型名，部分导出是 int 槽位索引；原样保留，不做 str 转换
+    type: Union[str, int] = Field(union_mode='left_to_right')
 
-    @classmethod
-    def validate_array(cls, value):
-        if isinstance(value, list) and len(value) >= 6:
-            return cls(
-                id=int(value[0]) if value[0] is not None else 0,
-                origin_id=int(value[1]) if value[1] is not None else 0,
-                origin_slot=int(value[2]) if value[2] is not None else 0,
-                target_id=int(value[3]) if value[3] is not None else 0,
-                target_slot=int(value[4]) if value[4] is not None else 0,
-                type=str(value[5]) if value[5] is not None else ""
-            )
-        return value
+
+def _link_from_array(link: List[Any]) -> ComfyLink:
+    id_, origin_id, origin_slot, target_id, target_slot, type_, *_ = link
+    return ComfyLink(
+        id=id_,
+        origin_id=origin_id,
+        origin_slot=origin_slot,
+        target_id=target_id,
+        target_slot=target_slot,
+        type=type_
+    )
 
 
 class ComfyWorkflow(BaseModel):
@@ -84,27 +92,13 @@ class ComfyWorkflow(BaseModel):
     extra: Dict[str, Any] = {}
     version: float = 0.2
 
-    @validator('links', pre=True)
+    @field_validator('links', mode='before')
+    @classmethod
     def validate_links(cls, v):
-        validated_links = []
-        for link in v:
-            if isinstance(link, list):
-                if len(link) >= 6:
-                    validated_links.append(ComfyLink(
-                        id=link[0],
-                        origin_id=link[1],
-                        origin_slot=link[2],
-                        target_id=link[3],
-                        target_slot=link[4],
-                        type=str(link[5])
-                    ))
-                else:
-                    validated_links.append(link)
-            elif isinstance(link, ComfyLink):
-                validated_links.append(link)
-            else:
-                validated_links.append(link)
-        return validated_links
+        return [
+            _link_from_array(link) if isinstance(link, list) and len(link) >= 6 else link
+            for link in v
+        ]
 
 
 class WorkflowIssue(BaseModel):
@@ -155,7 +149,8 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
-    workflow: Optional[ComfyWorkflow] = None
+    # 聊天接口只透传工作流，不做节点级校验；需要结构化访问时再 ComfyWorkflow.model_validate
+    workflow: Optional[Dict[str, Any]] = None
     error_log: Optional[str] = None
     session_id: str
     config_id: str
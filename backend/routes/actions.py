@@ -1,14 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from backend.models import ActionRequest, ActionResult, UndoRequest, UndoResult
 from backend.services.action_service import ActionService
 
 router = APIRouter()
 
-action_service = ActionService()
+
+def get_action_service(request: Request) -> ActionService:
+    return request.app.state.action_service
 
 
 @router.post("/execute", response_model=ActionResult)
-async def execute_action(request: ActionRequest):
+async def execute_action(request: ActionRequest, action_service: ActionService = Depends(get_action_service)):
     try:
         return await action_service.execute_action(request)
     except Exception as e:
@@ -16,7 +18,7 @@ async def execute_action(request: ActionRequest):
 
 
 @router.post("/undo", response_model=UndoResult)
-async def undo_action(request: UndoRequest):
+async def undo_action(request: UndoRequest, action_service: ActionService = Depends(get_action_service)):
     try:
         return await action_service.undo_action(request)
     except Exception as e:
@@ -1,15 +1,17 @@
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from backend.models import ChatRequest, ChatChunk
 from backend.services.chat_service import ChatService
 
 router = APIRouter()
 
-chat_service = ChatService()
+
+def get_chat_service(request: Request) -> ChatService:
+    return request.app.state.chat_service
 
 
 @router.post("/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, chat_service: ChatService = Depends(get_chat_service)):
     try:
         return await chat_service.stream_chat(request)
     except Exception as e:
@@ -17,9 +19,8 @@ async def chat_stream(request: ChatRequest):
 
 
 @router.post("/message")
-async def send_message(request: ChatRequest):
+async def send_message(request: ChatRequest, chat_service: ChatService = Depends(get_chat_service)):
     try:
-        print(request)
         response = await chat_service.process_message(request)
         return response
     except Exception as e:
@@ -27,7 +28,7 @@ async def send_message(request: ChatRequest):
 
 
 @router.get("/history/{session_id}")
-async def get_history(session_id: str):
+async def get_history(session_id: str, chat_service: ChatService = Depends(get_chat_service)):
     try:
         return await chat_service.get_history(session_id)
     except Exception as e:
@@ -10,6 +10,7 @@ from backend.models import (
     GitHubTokenResponse
 )
 from backend.services.config_service import config_service
+from backend.config import invalidate_github_token_cache
 
 router = APIRouter()
 
@@ -17,7 +18,7 @@ router = APIRouter()
 @router.post("/configs", response_model=APIProviderConfig)
 async def create_config(request: CreateProviderConfigRequest):
     try:
-        return config_service.create_config(request)
+        return await config_service.acreate_config(request)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -25,7 +26,7 @@ async def create_config(request: CreateProviderConfigRequest):
 @router.get("/configs", response_model=ProviderConfigListResponse)
 async def list_configs():
     try:
-        configs = config_service.get_configs()
+        configs = await config_service.aget_configs()
         return ProviderConfigListResponse(configs=configs, total=len(configs))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -33,7 +34,7 @@ async def list_configs():
 
 @router.get("/configs/{config_id}", response_model=APIProviderConfig)
 async def get_config(config_id: str):
-    config = config_service.get_config_by_id(config_id)
+    config = await config_service.aget_config_by_id(config_id)
     if config is None:
         raise HTTPException(status_code=404, detail="Config not found")
     return config
@@ -41,7 +42,7 @@ async def get_config(config_id: str):
 
 @router.get("/configs/default", response_model=APIProviderConfig)
 async def get_default_config():
-    config = config_service.get_default_config()
+    config = await config_service.aget_default_config()
     if config is None:
         raise HTTPException(status_code=404, detail="No default config found")
     return config
@@ -49,7 +50,7 @@ async def get_default_config():
 
 @router.put("/configs/{config_id}", response_model=APIProviderConfig)
 async def update_config(config_id: str, request: UpdateProviderConfigRequest):
-    config = config_service.update_config(config_id, request)
+    config = await config_service.aupdate_config(config_id, request)
     if config is None:
         raise HTTPException(status_code=404, detail="Config not found")
     return config
@@ -57,7 +58,7 @@ async def update_config(config_id: str, request: UpdateProviderConfigRequest):
 
 @router.delete("/configs/{config_id}", response_model=DeleteProviderConfigResponse)
 async def delete_config(config_id: str):
-    result = config_service.delete_config(config_id)
+    result = await config_service.adelete_config(config_id)
     if not result.success:
         raise HTTPException(status_code=404, detail=result.message)
     return result
@@ -65,7 +66,7 @@ async def delete_config(config_id: str):
 
 @router.post("/configs/set-default", response_model=APIProviderConfig)
 async def set_default_config(request: SetDefaultProviderRequest):
-    config = config_service.set_default_config(request.config_id)
+    config = await config_service.aset_default_config(request.config_id)
     if config is None:
         raise HTTPException(status_code=404, detail="Config not found")
     return config
@@ -74,7 +75,7 @@ async def set_default_config(request: SetDefaultProviderRequest):
 @router.get("/github-token", response_model=dict)
 async def get_github_token_status():
     try:
-        has_token = config_service.has_github_token()
+        has_token = await config_service.ahas_github_token()
         return {"has_token": has_token}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -83,7 +84,9 @@ async def get_github_token_status():
 @router.put("/github-token", response_model=GitHubTokenResponse)
 async def update_github_token(request: UpdateGitHubTokenRequest):
     try:
-        return config_service.update_github_token(request)
+        response = await config_service.aupdate_github_token(request)
+        invalidate_github_token_cache()
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -91,6 +94,8 @@ async def update_github_token(request: UpdateGitHubTokenRequest):
 @router.delete("/github-token", response_model=GitHubTokenResponse)
 async def delete_github_token():
     try:
-        return config_service.delete_github_token()
+        response = await config_service.adelete_github_token()
+        invalidate_github_token_cache()
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,14 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from backend.models import WorkflowParseRequest, WorkflowParseResponse
 from backend.services.workflow_service import WorkflowService
 
 router = APIRouter()
 
-workflow_service = WorkflowService()
+
+def get_workflow_service(request: Request) -> WorkflowService:
+    return request.app.state.workflow_service
 
 
 @router.post("/parse", response_model=WorkflowParseResponse)
-async def parse_workflow(request: WorkflowParseRequest):
+async def parse_workflow(request: WorkflowParseRequest, workflow_service: WorkflowService = Depends(get_workflow_service)):
     try:
         return await workflow_service.parse_workflow(request)
     except Exception as e:
@@ -16,7 +18,7 @@ async def parse_workflow(request: WorkflowParseRequest):
 
 
 @router.post("/analyze")
-async def analyze_workflow(request: WorkflowParseRequest):
+async def analyze_workflow(request: WorkflowParseRequest, workflow_service: WorkflowService = Depends(get_workflow_service)):
     try:
         return await workflow_service.analyze_workflow(request)
     except Exception as e:
@@ -1,21 +1,133 @@
 
 
-from typing import AsyncGenerator, Dict, Any, List, Optional
+from typing import AsyncGenerator, Dict, Any, List, Optional, Tuple
 from fastapi.responses import StreamingResponse
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
 from backend.models import ChatRequest, ChatChunk, APIProviderConfig
+from backend.agent.sse import iter_sse_data
 from backend.agent.workflow_agent import workflow_agent
 from backend.config import settings
 from backend.services.config_service import config_service
 import json
 import httpx
+import orjson
 import re
 import logging
 import asyncio
+import random
+from itertools import islice
 from datetime import datetime
+from cachetools import LRUCache
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 logger = logging.getLogger(__name__)
 
+_TEMPLATE_RE = re.compile(r"\$(\w+)")
+_WHOLE_VAR_RE = re.compile(r"^\$(\w+)$")
+
+def _sse(payload: Dict[str, Any]) -> bytes:
+    """编码一帧 SSE，直接产出 bytes"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+# 流结束帧内容固定，直接复用
+_FINAL_FRAME = _sse({"chunk": "", "is_complete": True, "type": "end"})
+
+_CHECKPOINT_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+_DEFAULT_HEADERS_TEMPLATE = '{"Content-Type": "application/json", "Authorization": "Bearer $apiKey"}'
+_DEFAULT_BODY_TEMPLATE = '{"model": "$model", "messages": $messages, "temperature": 0.5}'
+
+
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+_MAX_RETRY_DELAY = 30.0
+
+
+def _backoff_delay(attempt: int, base: float, response: Optional[httpx.Response] = None) -> float:
+    """指数退避 + full jitter；服务端给出 Retry-After（秒）时优先遵守"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), _MAX_RETRY_DELAY)
+            except ValueError:
+                pass
+    return random.uniform(0, min(_MAX_RETRY_DELAY, base * (2 ** (attempt - 1))))
+
+
+# LangChain 消息类型 -> 前端 sender
+_HISTORY_SENDERS = {"human": "user", "ai": "ai"}
+
+_MSG_CONVERTERS = {
+    dict: lambda m: m,
+    HumanMessage: lambda m: {"role": "user", "content": m.content},
+    AIMessage: lambda m: {"role": "assistant", "content": m.content},
+}
+
+
+def _convert_message(msg: Any) -> Optional[Dict[str, Any]]:
+    """按具体类型查表转换；子类（如 AIMessageChunk）走 isinstance 兜底，其余类型丢弃"""
+    converter = _MSG_CONVERTERS.get(type(msg))
+    if converter is None:
+        for cls, fn in _MSG_CONVERTERS.items():
+            if isinstance(msg, cls):
+                converter = fn
+                break
+        else:
+            return None
+    return converter(msg)
+
+
+class _Var:
+    """模板中整值占位的 "$name"，填充时替换为变量原始对象（不转字符串）"""
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _Text:
+    """内嵌 $var 的字符串，填充时做文本替换"""
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _compile_template(node: Any) -> Any:
+    """把解析后的 JSON 模板中的占位符换成标记，每个配置只做一次"""
+    if isinstance(node, str):
+        m = _WHOLE_VAR_RE.match(node)
+        if m:
+            return _Var(m.group(1))
+        return _Text(node) if "$" in node else node
+    if isinstance(node, dict):
+        return {k: _compile_template(v) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_compile_template(v) for v in node]
+    return node
+
+
+def _fill_template(node: Any, variables: Dict[str, Any]) -> Any:
+    if isinstance(node, _Var):
+        return variables[node.name] if node.name in variables else f"${node.name}"
+    if isinstance(node, _Text):
+        # 单次扫描替换 $var，未知变量原样保留
+        return _TEMPLATE_RE.sub(
+            lambda m: str(variables[m.group(1)]) if m.group(1) in variables else m.group(0),
+            node.text
+        )
+    if isinstance(node, dict):
+        return {k: _fill_template(v, variables) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_fill_template(v, variables) for v in node]
+    return node
+
 
 class ChatService:
     def __init__(self):
@@ -28,8 +140,164 @@ class ChatService:
             "execute_action": "正在执行修复指令...",
             "generate_response": "正在整理最终回复..."
         }
+        # 节点状态帧每次请求都一样，启动时编码一次
+        self._status_frames: Dict[str, bytes] = {
+            name: _sse({
+                "chunk": "",
+                "type": "status_update",
+                "metadata": {"node": name, "display_text": desc, "status": "processing"}
+            })
+            for name, desc in self.NODE_DESCRIPTIONS.items()
+        }
+        self._http: Optional[httpx.AsyncClient] = None
+        self._request_templates: LRUCache = LRUCache(maxsize=32)
+        self._upstream_limits: Dict[str, asyncio.Semaphore] = {}
+        # config_id -> (api_key, model_name, base_url, config)，配置保存时由 config_service 回调清空
+        self._config_cache: Dict[str, tuple] = {}
+        config_service.register_invalidation(self._config_cache.clear)
+        # 其余事件类型（占绝大多数）一次查表即跳过
+        self._event_handlers = {
+            "on_chat_model_stream": self._on_chat_model_stream,
+            "on_custom_event": self._on_custom_event,
+            "on_chain_start": self._on_chain_start,
+            "on_chain_end": self._on_chain_end,
+        }
+        self._checkpointer_cm = None
+        self._app = None
+        self._app_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._app_lock = asyncio.Lock()
+
+    # ---------------------------------------------------------
+    # stream_chat 事件处理：返回编码好的 SSE 帧，无需推送时返回 None
+    # ---------------------------------------------------------
+    def _on_chat_model_stream(self, event: Dict[str, Any]) -> Optional[bytes]:
+        # 场景 A: 捕获标准 LLM 的流式 Token (OpenAI, Google, Anthropic)
+        # data['chunk'] 是一个 AIMessageChunk 对象
+        chunk = event["data"].get("chunk")
+        if chunk and chunk.content:
+            payload = {
+                "chunk": chunk.content,
+                "type": "content",  # 标记为内容
+                "metadata": {"node": "generate_response"}
+            }
+            return _sse(payload)
+        return None
+
+    def _on_custom_event(self, event: Dict[str, Any]) -> Optional[bytes]:
+        # 场景 B: 捕获 Custom API 的手动流事件
+        if event["name"] != "custom_chunk":
+            return None
+        # data 是你在 adispatch_custom_event 中传入的字典
+        content = event["data"].get("chunk")
+        if content:
+            payload = {
+                "chunk": content,
+                "type": "content",
+                "metadata": {"node": "generate_response"}
+            }
+            return _sse(payload)
+        return None
+
+    def _on_chain_start(self, event: Dict[str, Any]) -> Optional[bytes]:
+        # 场景 C: 捕获节点切换状态 (UI显示“正在搜索...”)
+        # 过滤掉内部的小链，只关心图的主节点
+        return self._status_frames.get(event["name"])
+
+    def _on_chain_end(self, event: Dict[str, Any]) -> Optional[bytes]:
+        # 场景 D: 捕获特定节点的输出数据 (比如搜索结果)
+        event_name = event["name"]
+        if event_name != "search_solutions":
+            return None
+        output = event["data"].get("output")
+        # 只取前 3 条结果的标题，不复制整个结果列表
+        results = output.get("search_results") if isinstance(output, dict) else None
+        if results is None:
+            return None
+        # 推送元数据给前端展示
+        payload = {
+            "chunk": "",
+            "type": "meta_update",  # 元数据更新
+            "metadata": {
+                "node": event_name,
+                "step_data": {
+                    "search_previews": [r.get("title") for r in islice(results, 3)]
+                }
+            }
+        }
+        return _sse(payload)
+
+    def _upstream_semaphore(self, config: APIProviderConfig) -> asyncio.Semaphore:
+        """每个上游配置一个并发上限，custom_config.max_concurrency 可单独收紧（如本地 Ollama）"""
+        sem = self._upstream_limits.get(config.id)
+        if sem is None:
+            limit = (config.custom_config or {}).get("max_concurrency") or settings.LLM_MAX_CONCURRENCY
+            sem = asyncio.Semaphore(int(limit))
+            self._upstream_limits[config.id] = sem
+        return sem
+
+    async def _get_http(self) -> httpx.AsyncClient:
+        """Custom API 使用的长连接 HTTP 客户端，首次调用时创建"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=60.0,
+                trust_env=False,
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        return self._http
+
+    @staticmethod
+    async def _tune_checkpointer(checkpointer: AsyncSqliteSaver) -> None:
+        # checkpoint 写入频繁：WAL 下 synchronous=NORMAL 仍然崩溃安全；加大页缓存并启用 mmap
+        conn = checkpointer.conn
+        for pragma in _CHECKPOINT_PRAGMAS:
+            await conn.execute(pragma)
+        await conn.commit()
+
+    async def _get_app(self):
+        """绑定长连接 checkpointer 的图，首次调用时打开数据库，所有请求共用"""
+        loop = asyncio.get_running_loop()
+        if self._app is not None and self._app_loop is loop:
+            return self._app
+
+        async with self._app_lock:
+            if self._app is not None and self._app_loop is not loop:
+                # 连接绑定在旧的事件循环上，不能跨循环复用；先关闭，避免泄漏连接和后台线程
+                await self._close_checkpointer()
+            if self._app is None:
+                cm = AsyncSqliteSaver.from_conn_string(self.agent.db_path)
+                checkpointer = await cm.__aenter__()
+                self._checkpointer_cm = cm
+                await self._tune_checkpointer(checkpointer)
+                self._app = self.agent.with_checkpointer(checkpointer)
+                self._app_loop = loop
+                logger.info(f"[Chat] Checkpointer ready: {self.agent.db_path}")
+        return self._app
+
+    async def _close_checkpointer(self) -> None:
+        cm = self._checkpointer_cm
+        self._checkpointer_cm = None
+        self._app = None
+        self._app_loop = None
+        if cm is None:
+            return
+        try:
+            await cm.__aexit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"[Chat] Failed to close checkpointer: {e}")
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._checkpointer_cm is not None:
+            await self._close_checkpointer()
 
     def _get_api_config(self, config_id: str) -> tuple[str, str, str, Optional[APIProviderConfig]]:
+        cached = self._config_cache.get(config_id)
+        if cached is not None:
+            return cached
+
         config = config_service.get_config_by_id(config_id)
 
         logger.info(f"[Chat] Loading config by ID: {config_id}")
@@ -45,114 +313,113 @@ class ChatService:
         logger.info(f"[Chat] Config loaded - Name: {config.name}, Provider: {config.provider.value}")
         logger.info(f"[Chat] Final config - Model: {model_name}, Base URL: {base_url}")
 
-        return api_key, model_name, base_url, config
-
-    def _parse_template(self, template: str, variables: Dict[str, Any]) -> str:
-        result = template
-        for key, value in variables.items():
-            placeholder = f"${key}"
-            result = result.replace(placeholder, str(value))
-        return result
+        resolved = (api_key, model_name, base_url, config)
+        self._config_cache[config_id] = resolved
+        return resolved
 
-    async def _call_custom_api(self, config: APIProviderConfig, messages: List[Any], stream: bool = False,
-                               max_retries: int = 3, retry_delay: float = 2.0) -> AsyncGenerator[str, None]:
-        if not config.custom_config:
-            raise ValueError("Custom config is required for custom provider")
+    def _get_request_template(self, config: APIProviderConfig) -> Tuple[str, Dict[str, Any], Any]:
+        """按 (config.id, updated_at) 缓存 URL、已填充的 headers 和预编译的 body 模板"""
+        key = (config.id, config.updated_at)
+        cached = self._request_templates.get(key)
+        if cached is not None:
+            return cached
 
         custom_config = config.custom_config
         endpoint = custom_config.get("endpoint", "/chat/completions")
-        headers_template = custom_config.get("headers",
-                                             '{"Content-Type": "application/json", "Authorization": "Bearer $apiKey"}')
-        body_template = custom_config.get("body", '{"model": "$model", "messages": $messages, "temperature": 0.5}')
-
-        logger.info(f"[Custom API] Calling custom API with config: {config.name}")
-        logger.info(f"[Custom API] Base URL: {config.base_url}")
-        logger.info(f"[Custom API] Endpoint: {endpoint}")
-        logger.info(f"[Custom API] Model: {config.model_name}")
-        logger.info(f"[Custom API] Stream: {stream}")
-
-        messages_list = []
-        for msg in messages:
-            if isinstance(msg, dict):
-                messages_list.append(msg)
-            elif isinstance(msg, HumanMessage):
-                messages_list.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                messages_list.append({"role": "assistant", "content": msg.content})
-
-        logger.info(f"[Custom API] Final messages list: {json.dumps(messages_list, ensure_ascii=False)}")
-
-        variables = {
-            "apiKey": config.api_key or "",
-            "model": config.model_name or "",
-            "messages": json.dumps(messages_list)
-        }
+        headers_template = custom_config.get("headers", _DEFAULT_HEADERS_TEMPLATE)
+        body_template = custom_config.get("body", _DEFAULT_BODY_TEMPLATE)
+        static_vars = {"apiKey": config.api_key or "", "model": config.model_name or ""}
 
         url = f"{config.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
-        logger.info(f"[Custom API] Full URL: {url}")
 
-        headers_str = self._parse_template(headers_template, variables)
         try:
-            headers = json.loads(headers_str)
+            headers = _fill_template(_compile_template(json.loads(headers_template)), static_vars)
         except json.JSONDecodeError:
-            logger.error(f"[Custom API] Invalid headers JSON: {headers_str}")
-            raise ValueError(f"Invalid headers JSON: {headers_str}")
+            logger.error(f"[Custom API] Invalid headers JSON: {headers_template}")
+            raise ValueError(f"Invalid headers JSON: {headers_template}")
 
-        logger.info(f"[Custom API] Headers: {headers}")
-        temp_template = body_template.replace('"$messages"', 'null').replace('$messages', 'null')
-        variables_without_list = {k: v for k, v in variables.items() if k != 'messages'}
-        body_str = self._parse_template(temp_template, variables_without_list)
+        # $messages 在模板里通常不带引号，先统一成字符串占位再解析
+        normalized = body_template.replace('"$messages"', '$messages').replace('$messages', '"$messages"')
         try:
-            body = json.loads(body_str)
-            body['messages'] = messages_list
+            body = _compile_template(json.loads(normalized))
         except json.JSONDecodeError:
-            logger.error(f"[Custom API] Invalid body JSON: {body_str}")
-            raise ValueError(f"Invalid body JSON: {body_str}")
+            logger.error(f"[Custom API] Invalid body JSON: {body_template}")
+            raise ValueError(f"Invalid body JSON: {body_template}")
+
+        cached = (url, headers, body)
+        self._request_templates[key] = cached
+        return cached
+
+    async def _call_custom_api(self, config: APIProviderConfig, messages: List[Any], stream: bool = False,
+                               max_retries: int = 3, retry_delay: float = 2.0) -> AsyncGenerator[str, None]:
+        if not config.custom_config:
+            raise ValueError("Custom config is required for custom provider")
+
+        messages_list = [
+            converted for converted in (_convert_message(msg) for msg in messages) if converted is not None
+        ]
 
-        logger.info(f"[Custom API] Request body: {json.dumps(body, ensure_ascii=False)}")
-        logger.info(
-            f"[Custom API] Full request - URL: {url}, Headers: {headers}, Body: {json.dumps(body, ensure_ascii=False)}")
+        url, headers, body_template = self._get_request_template(config)
+        logger.info("[Custom API] POST %s config=%s model=%s messages=%d stream=%s",
+                    url, config.name, config.model_name, len(messages_list), stream)
+
+        body = _fill_template(body_template, {
+            "apiKey": config.api_key or "",
+            "model": config.model_name or "",
+            "messages": messages_list
+        })
+        if isinstance(body, dict) and "messages" not in body:
+            body["messages"] = messages_list
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Custom API] headers=%s body=%s", headers, json.dumps(body, ensure_ascii=False))
 
         retry_count = 0
         last_error = None
 
         while retry_count < max_retries:
             try:
-                async with httpx.AsyncClient(timeout=60.0, trust_env=False) as client:
+                # 只在请求期间占用名额，退避等待时释放
+                async with self._upstream_semaphore(config):
+                    client = await self._get_http()
                     if stream:
                         logger.info("[Custom API] Starting streaming request...")
-                        response = await client.post(url, json=body, headers=headers)
-                        logger.info(f"[Custom API] Response status: {response.status_code}")
-
-                        if response.status_code >= 500:
-                            raise httpx.HTTPStatusError(
-                                f"Server error {response.status_code}",
-                                request=None,
-                                response=response
-                            )
-
-                        response.raise_for_status()
-
-                        full_text = ""
-                        chunk_count = 0
-                        async for line in response.aiter_lines():
-                            if line.strip().startswith('data: '):
-                                data_str = line.strip()[6:]
-                                if data_str == '[DONE]':
+                        async with client.stream("POST", url, json=body, headers=headers) as response:
+                            logger.info(f"[Custom API] Response status: {response.status_code}")
+
+                            if response.status_code in _RETRYABLE_STATUS:
+                                raise httpx.HTTPStatusError(
+                                    f"Server error {response.status_code}",
+                                    request=None,
+                                    response=response
+                                )
+
+                            response.raise_for_status()
+
+                            full_text = ""
+                            chunk_count = 0
+                            async for payload in iter_sse_data(response):
+                                if payload == b"[DONE]":
                                     logger.info(f"[Custom API] Streaming completed. Total chunks: {chunk_count}")
                                     break
 
+                                if not payload:
+                                    continue
+                                # 不以结尾括号收尾的负载（keep-alive 等）不是 JSON，直接跳过
+                                if payload[-1:] not in (b"}", b"]"):
+                                    continue
+
                                 try:
-                                    data = json.loads(data_str)
+                                    data = orjson.loads(payload)
                                     if 'choices' in data and len(data['choices']) > 0:
                                         delta = data['choices'][0].get('delta', {})
                                         content = delta.get('content', '')
                                         if content:
                                             full_text += content
                                             chunk_count += 1
-                                            logger.debug(f"[Custom API] Chunk {chunk_count}: {content}")
+                                            logger.debug("[Custom API] chunk %d: %s", chunk_count, content)
                                             yield content
-                                except json.JSONDecodeError as e:
+                                except orjson.JSONDecodeError as e:
                                     logger.warning(f"[Custom API] Failed to parse chunk: {e}")
                                     continue
                     else:
@@ -160,7 +427,7 @@ class ChatService:
                         response = await client.post(url, json=body, headers=headers)
                         logger.info(f"[Custom API] Response status: {response.status_code}")
 
-                        if response.status_code >= 500:
+                        if response.status_code in _RETRYABLE_STATUS:
                             raise httpx.HTTPStatusError(
                                 f"Server error {response.status_code}",
                                 request=None,
@@ -170,7 +437,8 @@ class ChatService:
                         response.raise_for_status()
 
                         data = response.json()
-                        logger.info(f"[Custom API] Response data: {json.dumps(data, ensure_ascii=False)}")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("[Custom API] Response data: %s", json.dumps(data, ensure_ascii=False))
 
                         if 'choices' in data and len(data['choices']) > 0:
                             content = data['choices'][0].get('message', {}).get('content', '')
@@ -180,17 +448,17 @@ class ChatService:
                             logger.warning(f"[Custom API] Unexpected response format: {data}")
                             yield str(data)
 
-                return
+                    return
 
             except httpx.HTTPStatusError as e:
                 last_error = e
                 retry_count += 1
 
-                if e.response and e.response.status_code >= 500 and retry_count <= max_retries:
+                if e.response is not None and e.response.status_code in _RETRYABLE_STATUS and retry_count <= max_retries:
+                    delay = _backoff_delay(retry_count, retry_delay, e.response)
                     logger.warning(
-                        f"[Custom API] Server error {e.response.status_code}, retry {retry_count}/{max_retries} in {retry_delay}s...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2
+                        f"[Custom API] Server error {e.response.status_code}, retry {retry_count}/{max_retries} in {delay:.2f}s...")
+                    await asyncio.sleep(delay)
                     continue
                 else:
                     logger.error(f"[Custom API] HTTP error: {e}")
@@ -201,10 +469,10 @@ class ChatService:
                 retry_count += 1
 
                 if retry_count <= max_retries:
+                    delay = _backoff_delay(retry_count, retry_delay)
                     logger.warning(
-                        f"[Custom API] Request error: {e}, retry {retry_count}/{max_retries} in {retry_delay}s...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2
+                        f"[Custom API] Request error: {e}, retry {retry_count}/{max_retries} in {delay:.2f}s...")
+                    await asyncio.sleep(delay)
                     continue
                 else:
                     logger.error(f"[Custom API] Request error: {e}")
@@ -214,131 +482,61 @@ class ChatService:
         raise last_error
 
     async def stream_chat(self, request: ChatRequest) -> StreamingResponse:
-        agent_workflow = self.agent.workflow_graph
         async def generate():
-            async with AsyncSqliteSaver.from_conn_string(self.agent.db_path) as checkpointer:
-                try:
-                    print(f"[Stream Chat] Starting stream chat for session: {request.session_id}")
-                    print(f"[Stream Chat] Message: {request.message[:100]}...")
-                    print(f"[Stream Chat] Config ID: {request.config_id}")
-
-                    api_key, model_name, base_url, config = self._get_api_config(request.config_id)
-
-                    logger.info(f"[Stream Chat] Using LangGraph agent with provider: {config.provider.value}")
-                    state = {
-                        "messages": [HumanMessage(content=request.message)],
-                        "config": config,
-                        "workflow": request.workflow.model_dump() if request.workflow else None,
-                        "error_log": request.error_log,
-                        "session_id": request.session_id,
-                        "language": request.language.value,
-                        "provider": config.provider.value,
-                        "api_key": api_key,
-                        "model_name": model_name,
-                        "base_url": base_url,
-                        "current_step": "",
-                        "search_results": [],
-                        "solutions": [],
-                        "can_auto_fix": False,
-                        "requires_user_confirmation": False,
-                        "action_type": None,
-                        "action_data": None,
-                        "workflow_analysis": None
-                    }
-
-                    config_dict = {"configurable": {"thread_id": request.session_id}}
-                    logger.info("[Stream Chat] Starting LangGraph agent stream...")
-                    app = agent_workflow.compile(checkpointer=checkpointer)
-                    async for event in app.astream_events(state, config_dict,version="v2"):
-                        event_type = event["event"]
-                        event_name = event["name"]
-                        event_data = event["data"]
-
-                        # ---------------------------------------------------------
-                        # 场景 A: 捕获标准 LLM 的流式 Token (OpenAI, Google, Anthropic)
-                        # ---------------------------------------------------------
-                        if event_type == "on_chat_model_stream":
-                            # data['chunk'] 是一个 AIMessageChunk 对象
-                            chunk = event_data.get("chunk")
-                            if chunk and chunk.content:
-                                payload = {
-                                    "chunk": chunk.content,
-                                    "type": "content",  # 标记为内容
-                                    "metadata": {"node": "generate_response"}
-                                }
-                                yield f"data: {json.dumps(payload)}\n\n"
-
-                        # ---------------------------------------------------------
-                        # 场景 B: 捕获 Custom API 的手动流事件
-                        # ---------------------------------------------------------
-                        elif event_type == "on_custom_event" and event_name == "custom_chunk":
-                            # data 是你在 adispatch_custom_event 中传入的字典
-                            content = event_data.get("chunk")
-                            if content:
-                                payload = {
-                                    "chunk": content,
-                                    "type": "content",
-                                    "metadata": {"node": "generate_response"}
-                                }
-                                yield f"data: {json.dumps(payload)}\n\n"
-
-                        # ---------------------------------------------------------
-                        # 场景 C: 捕获节点切换状态 (UI显示“正在搜索...”)
-                        # ---------------------------------------------------------
-                        elif event_type == "on_chain_start":
-                            # 过滤掉内部的小链，只关心图的主节点
-                            if event_name in self.NODE_DESCRIPTIONS:
-                                display_text = self.NODE_DESCRIPTIONS.get(event_name, "处理中...")
-                                payload = {
-                                    "chunk": "",
-                                    "type": "status_update",
-                                    "metadata": {
-                                        "node": event_name,
-                                        "display_text": display_text,
-                                        "status": "processing"
-                                    }
-                                }
-                                yield f"data: {json.dumps(payload)}\n\n"
-
-                        # ---------------------------------------------------------
-                        # 场景 D: 捕获特定节点的输出数据 (比如搜索结果)
-                        # ---------------------------------------------------------
-                        elif event_type == "on_chain_end":
-                            if event_name == "search_solutions":
-                                output = event_data.get("output", {})
-                                # 如果 output 是 dict 且包含 search_results
-                                if isinstance(output, dict) and "search_results" in output:
-                                    results = output["search_results"]
-                                    # 推送元数据给前端展示
-                                    payload = {
-                                        "chunk": "",
-                                        "type": "meta_update",  # 元数据更新
-                                        "metadata": {
-                                            "node": event_name,
-                                            "step_data": {
-                                                "search_previews": [r.get("title") for r in results[:3]]
-                                            }
-                                        }
-                                    }
-                                    yield f"data: {json.dumps(payload)}\n\n"
-
-                        # 3. 结束流
-                    final_chunk = {
-                        "chunk": "",
-                        "is_complete": True,
-                        "type": "end"
-                    }
-                    yield f"data: {json.dumps(final_chunk)}\n\n"
-                    logger.info("[Stream Chat] Completed")
-
-                except Exception as e:
-                    logger.error(f"[Stream Chat] Error: {str(e)}", exc_info=True)
-                    error_chunk = {
-                        "chunk": f"Error: {str(e)}",
-                        "is_complete": True,
-                        "metadata": {"error": True}
-                    }
-                    yield f"data: {json.dumps(error_chunk)}\n\n"
+            try:
+                logger.info("[Stream Chat] Starting stream chat for session: %s, config: %s",
+                            request.session_id, request.config_id)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[Stream Chat] Message: %s...", request.message[:100])
+
+                api_key, model_name, base_url, config = self._get_api_config(request.config_id)
+
+                logger.info(f"[Stream Chat] Using LangGraph agent with provider: {config.provider.value}")
+                state = {
+                    "messages": [HumanMessage(content=request.message)],
+                    "config": config,
+                    "workflow": request.workflow,
+                    "error_log": request.error_log,
+                    "session_id": request.session_id,
+                    "language": request.language.value,
+                    "provider": config.provider.value,
+                    "api_key": api_key,
+                    "model_name": model_name,
+                    "base_url": base_url,
+                    "current_step": "",
+                    "search_results": [],
+                    "solutions": [],
+                    "can_auto_fix": False,
+                    "requires_user_confirmation": False,
+                    "action_type": None,
+                    "action_data": None,
+                    "workflow_analysis": None,
+                    "actionable_solution": None
+                }
+
+                config_dict = {"configurable": {"thread_id": request.session_id}}
+                logger.info("[Stream Chat] Starting LangGraph agent stream...")
+                app = await self._get_app()
+                async for event in app.astream_events(state, config_dict,version="v2"):
+                    handler = self._event_handlers.get(event["event"])
+                    if handler is None:
+                        continue
+                    frame = handler(event)
+                    if frame:
+                        yield frame
+
+                    # 3. 结束流
+                yield _FINAL_FRAME
+                logger.info("[Stream Chat] Completed")
+
+            except Exception as e:
+                logger.error(f"[Stream Chat] Error: {str(e)}", exc_info=True)
+                error_chunk = {
+                    "chunk": f"Error: {str(e)}",
+                    "is_complete": True,
+                    "metadata": {"error": True}
+                }
+                yield _sse(error_chunk)
 
         return StreamingResponse(
             generate(),
@@ -363,9 +561,9 @@ class ChatService:
                 messages_list = []
                 messages_list.append({"role": "user", "content": request.message})
 
-                response_text = ""
-                async for chunk in self._call_custom_api(config, messages_list, stream=False):
-                    response_text += chunk
+                response_text = "".join([
+                    chunk async for chunk in self._call_custom_api(config, messages_list, stream=False)
+                ])
 
                 logger.info(f"[Process Message] Custom API response length: {len(response_text)}")
                 return {
@@ -380,7 +578,7 @@ class ChatService:
             logger.info(f"[Process Message] Using LangGraph agent with provider: {config.provider.value}")
             state = {
                 "messages": [HumanMessage(content=request.message)],
-                "workflow": request.workflow.model_dump() if request.workflow else None,
+                "workflow": request.workflow,
                 "error_log": request.error_log,
                 "session_id": request.session_id,
                 "language": request.language.value,
@@ -395,36 +593,34 @@ class ChatService:
                 "requires_user_confirmation": False,
                 "action_type": None,
                 "action_data": None,
-                "workflow_analysis": None
+                "workflow_analysis": None,
+                "actionable_solution": None
             }
 
             config_dict = {"configurable": {"thread_id": request.session_id}}
             
-            # Use AsyncSqliteSaver to persist state, same as stream_chat
-            async with AsyncSqliteSaver.from_conn_string(self.agent.db_path) as checkpointer:
-                logger.info("[Process Message] Compiling and invoking agent...")
-                app = self.agent.workflow_graph.compile(checkpointer=checkpointer)
-                result = await app.ainvoke(state, config_dict)
-                logger.info("[Process Message] Agent invoke completed")
-
-                final_messages = result.get("messages", [])
-                response_text = ""
-                for msg in final_messages:
-                    if isinstance(msg, AIMessage):
-                        response_text += msg.content
-                    elif hasattr(msg, "content") and hasattr(msg, "type") and msg.type == "ai":
-                         # Handle case where messages might be dicts if not fully reconstituted
-                         response_text += msg.content
-
-                logger.info(f"[Process Message] Response length: {len(response_text)}")
-                return {
-                    "response": response_text,
-                    "requires_user_confirmation": result.get("requires_user_confirmation", False),
-                    "action_type": result.get("action_type"),
-                    "action_data": result.get("action_data"),
-                    "solutions": result.get("solutions", []),
-                    "search_results": result.get("search_results", [])
-                }
+            # 与 stream_chat 共用同一个长连接 checkpointer
+            logger.info("[Process Message] Invoking agent...")
+            app = await self._get_app()
+            result = await app.ainvoke(state, config_dict)
+            logger.info("[Process Message] Agent invoke completed")
+
+            final_messages = result.get("messages", [])
+            # Handle case where messages might not be fully reconstituted into AIMessage
+            response_text = "".join([
+                msg.content for msg in final_messages
+                if isinstance(msg, AIMessage) or (hasattr(msg, "content") and getattr(msg, "type", None) == "ai")
+            ])
+
+            logger.info(f"[Process Message] Response length: {len(response_text)}")
+            return {
+                "response": response_text,
+                "requires_user_confirmation": result.get("requires_user_confirmation", False),
+                "action_type": result.get("action_type"),
+                "action_data": result.get("action_data"),
+                "solutions": result.get("solutions", []),
+                "search_results": result.get("search_results", [])
+            }
 
         except Exception as e:
             logger.error(f"[Process Message] Error: {str(e)}", exc_info=True)
@@ -437,42 +633,32 @@ class ChatService:
         """Retrieve chat history from LangGraph checkpointer"""
         try:
             config = {"configurable": {"thread_id": session_id}}
-            async with AsyncSqliteSaver.from_conn_string(self.agent.db_path) as checkpointer:
-                # Compile the graph with checkpointer to enable correct state hydration
-                app = self.agent.workflow_graph.compile(checkpointer=checkpointer)
-                
-                # Use aget_state to retrieve the re-hydrated state object
-                # This correctly deserializes messages back into LangChain objects
-                state_snapshot = await app.aget_state(config)
-                
-                if not state_snapshot or not state_snapshot.values:
-                    return []
-                
-                messages = state_snapshot.values.get("messages", [])
-                
-                # Format messages for frontend
-                formatted_history = []
-                # Only take the last 'limit' messages to avoid context overflow
-                recent_messages = messages[-limit:] if limit > 0 else messages
-                
-                for msg in recent_messages:
-                    msg_type = msg.type if hasattr(msg, "type") else "unknown"
-                    content = msg.content if hasattr(msg, "content") else str(msg)
-                    
-                    if msg_type == "human":
-                        formatted_history.append({
-                            "sender": "user",
-                            "text": content,
-                            "timestamp": datetime.now().isoformat() 
-                        })
-                    elif msg_type == "ai":
-                        formatted_history.append({
-                            "sender": "ai",
-                            "text": content,
-                            "timestamp": datetime.now().isoformat()
-                        })
-                
-                return formatted_history
+            app = await self._get_app()
+            
+            # Use aget_state to retrieve the re-hydrated state object
+            # This correctly deserializes messages back into LangChain objects
+            state_snapshot = await app.aget_state(config)
+            
+            if not state_snapshot or not state_snapshot.values:
+                return []
+            
+            messages = state_snapshot.values.get("messages", [])
+            
+            # Format messages for frontend
+            # Only take the last 'limit' messages to avoid context overflow
+            recent_messages = messages[-limit:] if limit > 0 else messages
+            now_iso = datetime.now().isoformat()
+            formatted_history = [
+                {
+                    "sender": _HISTORY_SENDERS[msg_type],
+                    "text": msg.content if hasattr(msg, "content") else str(msg),
+                    "timestamp": now_iso
+                }
+                for msg in recent_messages
+                if (msg_type := getattr(msg, "type", None)) in _HISTORY_SENDERS
+            ]
+            
+            return formatted_history
         except Exception as e:
             logger.error(f"Error fetching history: {e}", exc_info=True)
             return []
@@ -1,8 +1,10 @@
-import json
+import asyncio
+import mmap
 import os
+import threading
+import time
 import uuid
-from typing import List, Optional
-from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 from backend.models import (
     APIProviderConfig,
     CreateProviderConfigRequest,
@@ -16,8 +18,41 @@ from backend.models import (
 from backend.config import settings
 import logging
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
+# 连续修改合并为一次落盘的等待时间（秒）
+_FLUSH_DELAY = 0.05
+# 后台落盘失败后的重试间隔（秒）
+_FLUSH_RETRY_DELAY = 1.0
+# 超过该大小的 providers.json 通过 mmap 解析，小文件直接 read 更快
+_MMAP_MIN_SIZE = 64 * 1024
+
+
+class _ConfigState(NamedTuple):
+    """providers.json 的内存副本及其索引，整体替换，读者拿到的字段总是相互一致"""
+    configs: List[APIProviderConfig]
+    # 与 configs 一一对应的 model_dump() 结果，落盘时只重新 dump 改动过的条目
+    dumps: List[dict]
+    mtime: Optional[int]
+    # id -> 下标，provider -> 第一个该 provider 的 id，当前默认配置 id
+    by_id: Dict[str, int]
+    by_provider: Dict[str, str]
+    default_id: Optional[str]
+
+
+def _build_state(configs: List[APIProviderConfig], dumps: List[dict], mtime: Optional[int]) -> _ConfigState:
+    by_id: Dict[str, int] = {}
+    by_provider: Dict[str, str] = {}
+    default_id = None
+    for i, config in enumerate(configs):
+        by_id.setdefault(config.id, i)
+        by_provider.setdefault(config.provider.value, config.id)
+        if default_id is None and config.is_default:
+            default_id = config.id
+    return _ConfigState(configs, dumps, mtime, by_id, by_provider, default_id)
+
 
 class ConfigService:
     def __init__(self):
@@ -25,41 +60,214 @@ class ConfigService:
         os.makedirs(self.config_dir, exist_ok=True)
         self.config_file = os.path.join(self.config_dir, "providers.json")
         self.github_token_file = os.path.join(self.config_dir, "github_token.json")
+        self._invalidation_callbacks: List[Callable[[], None]] = []
+        # 按文件 mtime 校验；只在事件循环（或无循环时的调用线程）上整体替换
+        self._state: Optional[_ConfigState] = None
+        self._gh_token_cache: Optional[Tuple[int, Optional[str]]] = None
+        # 每次更新/删除 GitHub token 时加一，供调用方做进程内缓存校验
+        self.github_token_version = 0
+        # 内存中有尚未写入 providers.json 的修改
+        self._dirty = False
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # 每次修改加一，后台写入期间若有新修改则不清除 dirty
+        self._generation = 0
+        # 已写入文件的最新版本，避免较旧的后台写入覆盖较新的内容
+        self._written_generation = 0
+        self._flush_lock = threading.Lock()
+
+    def register_invalidation(self, callback: Callable[[], None]) -> None:
+        """注册配置变更回调，供调用方清理自己缓存的配置"""
+        self._invalidation_callbacks.append(callback)
+
+    def _notify_invalidation(self) -> None:
+        for callback in self._invalidation_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"[Config] Invalidation callback failed: {e}", exc_info=True)
     
-    def _load_configs(self) -> List[APIProviderConfig]:
-        if not os.path.exists(self.config_file):
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes) -> None:
+        """先写临时文件并 fsync，再 os.replace 覆盖，写到一半崩溃也不会损坏原文件"""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _fresh_state(self, mtime: Optional[int]) -> Optional[_ConfigState]:
+        state = self._state
+        if state is not None and (self._dirty or mtime == state.mtime):
+            return state
+        return None
+
+    async def _aload_configs(self) -> _ConfigState:
+        """缓存有效时直接返回；需要读文件时只把读取和解析放到线程池，结果回到事件循环再安装"""
+        mtime = self._mtime(self.config_file)
+        state = self._fresh_state(mtime)
+        if state is not None:
+            return state
+        configs = await asyncio.to_thread(self._read_configs, mtime)
+        # 等待期间可能已有其他协程安装了新状态或做了修改
+        state = self._fresh_state(mtime)
+        if state is not None:
+            return state
+        return self._install(configs, mtime)
+
+    @staticmethod
+    def _read_json(f):
+        if os.fstat(f.fileno()).st_size < _MMAP_MIN_SIZE:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+
+    def _read_configs(self, mtime: Optional[int]) -> Optional[List[APIProviderConfig]]:
+        """只读取并解析文件，不触碰实例状态，可在线程池中运行；读取失败返回 None"""
+        if mtime is None:
             logger.info(f"[Config] Config file not found: {self.config_file}")
             return []
-        
         try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"[Config] Loaded {len(data)} configs from file")
-                return [APIProviderConfig(**item) for item in data]
+            with open(self.config_file, 'rb') as f:
+                data = self._read_json(f)
+            logger.info(f"[Config] Loaded {len(data)} configs from file")
+            return [APIProviderConfig(**item) for item in data]
         except Exception as e:
             logger.error(f"[Config] Error loading configs: {e}", exc_info=True)
-            return []
+            return None
+
+    def _install(self, configs: Optional[List[APIProviderConfig]], mtime: Optional[int]) -> _ConfigState:
+        """用解析结果整体替换缓存；读取失败时保留旧缓存"""
+        old = self._state
+        if configs is None:
+            if old is None:
+                old = self._state = _build_state([], [], None)
+            return old
+        self._state = _build_state(configs, [config.model_dump() for config in configs], mtime)
+        if old is not None:
+            # 文件被外部修改，通知调用方丢弃旧配置
+            self._notify_invalidation()
+        return self._state
+
+    def _load_configs(self) -> _ConfigState:
+        """返回缓存的配置状态（只读）；文件 mtime 变化时在当前线程重新加载"""
+        mtime = self._mtime(self.config_file)
+        state = self._fresh_state(mtime)
+        if state is not None:
+            return state
+        return self._install(self._read_configs(mtime), mtime)
+
+    def _reindex(self) -> _ConfigState:
+        state = self._state
+        self._state = _build_state(state.configs, state.dumps, state.mtime)
+        return self._state
+
+    def _clear_default(self, state: _ConfigState) -> Optional[int]:
+        """取消当前默认配置，返回其下标"""
+        if state.default_id is None:
+            return None
+        i = state.by_id[state.default_id]
+        state.configs[i].is_default = False
+        return i
     
-    def _save_configs(self, configs: List[APIProviderConfig]) -> None:
+    def _save_configs(self, changed: Iterable[Optional[int]] = ()) -> None:
+        """就地修改缓存的配置后调用：重新 dump 改动的条目并重建索引，再延迟落盘"""
+        state = self._state
+        for i in changed:
+            if i is not None:
+                state.dumps[i] = state.configs[i].model_dump()
+        self._reindex()
+        self._dirty = True
+        self._generation += 1
+        self._notify_invalidation()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（脚本、线程池），直接同步写入
+            self.flush()
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(_FLUSH_DELAY, self._flush_in_background, loop)
+
+    def _flush_in_background(self, loop: asyncio.AbstractEventLoop) -> None:
+        """在事件循环上取快照，线程池只负责写文件，句柄和 dirty 状态都留在循环上维护"""
+        self._flush_handle = None
+        if not self._dirty:
+            return
+        generation = self._generation
+        dumps = list(self._state.dumps)
+        future = loop.run_in_executor(None, self._write_snapshot, generation, dumps)
+        future.add_done_callback(lambda f: self._on_flush_done(loop, generation, f))
+
+    def _on_flush_done(self, loop: asyncio.AbstractEventLoop, generation: int, future: "asyncio.Future") -> None:
+        try:
+            mtime = future.result()
+        except Exception as e:
+            logger.error(f"[Config] Error saving configs, retrying in {_FLUSH_RETRY_DELAY}s: {e}", exc_info=True)
+            # 保留 dirty，稍后重试；关闭时的 flush() 也会再写一次
+            if self._flush_handle is None and not loop.is_closed():
+                self._flush_handle = loop.call_later(_FLUSH_RETRY_DELAY, self._flush_in_background, loop)
+            return
+        self._mark_flushed(generation, mtime)
+
+    def _mark_flushed(self, generation: int, mtime: Optional[int]) -> None:
+        if mtime is not None:
+            self._state = self._state._replace(mtime=mtime)
+        if generation == self._generation:
+            self._dirty = False
+
+    def _write_snapshot(self, generation: int, dumps: List[dict]) -> Optional[int]:
+        """写入指定版本的快照并返回新的 mtime；已有更新的版本落盘时跳过，返回 None"""
+        with self._flush_lock:
+            if generation <= self._written_generation:
+                return None
+            self._atomic_write(self.config_file, orjson.dumps(dumps, option=orjson.OPT_INDENT_2))
+            self._written_generation = generation
+            logger.info(f"[Config] Saved {len(dumps)} configs to file")
+            return self._mtime(self.config_file)
+
+    def flush(self) -> None:
+        """同步写入未落盘的修改（关闭时或不在事件循环中），失败时保留 dirty"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        generation = self._generation
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump([config.model_dump() for config in configs], f, indent=2, ensure_ascii=False)
-            logger.info(f"[Config] Saved {len(configs)} configs to file")
+            mtime = self._write_snapshot(generation, list(self._state.dumps))
         except Exception as e:
             logger.error(f"[Config] Error saving configs: {e}", exc_info=True)
-            raise Exception(f"Error saving configs: {e}")
+            return
+        self._mark_flushed(generation, mtime)
     
     def create_config(self, request: CreateProviderConfigRequest) -> APIProviderConfig:
-        configs = self._load_configs()
+        state = self._load_configs()
         
         config_id = str(uuid.uuid4())
-        now = datetime.now().timestamp()
+        now = time.time()
         
         logger.info(f"[Config] Creating new config: {request.name}, Provider: {request.provider.value}")
         
+        old_default = None
         if request.is_default:
-            for config in configs:
-                config.is_default = False
+            old_default = self._clear_default(state)
             logger.info(f"[Config] Setting {request.name} as default, clearing other defaults")
         
         custom_config_dict = None
@@ -80,154 +288,150 @@ class ConfigService:
             updated_at=now
         )
         
-        configs.append(new_config)
-        self._save_configs(configs)
+        state.configs.append(new_config)
+        state.dumps.append(new_config.model_dump())
+        self._save_configs((old_default,))
         
         logger.info(f"[Config] Config created successfully: {config_id}")
         return new_config
     
     def get_configs(self) -> List[APIProviderConfig]:
-        return self._load_configs()
+        return list(self._load_configs().configs)
     
     def get_config_by_id(self, config_id: str) -> Optional[APIProviderConfig]:
-        configs = self._load_configs()
-        for config in configs:
-            if config.id == config_id:
-                return config
-        return None
+        state = self._load_configs()
+        i = state.by_id.get(config_id)
+        return state.configs[i] if i is not None else None
     
     def get_default_config(self) -> Optional[APIProviderConfig]:
-        configs = self._load_configs()
-        for config in configs:
-            if config.is_default:
-                return config
-        return None
+        state = self._load_configs()
+        if state.default_id is None:
+            return None
+        return state.configs[state.by_id[state.default_id]]
     
     def get_config_by_provider(self, provider: str) -> Optional[APIProviderConfig]:
-        configs = self._load_configs()
-        for config in configs:
-            if config.provider.value == provider:
-                return config
-        return None
+        state = self._load_configs()
+        config_id = state.by_provider.get(provider)
+        return state.configs[state.by_id[config_id]] if config_id is not None else None
     
     def update_config(self, config_id: str, request: UpdateProviderConfigRequest) -> Optional[APIProviderConfig]:
-        configs = self._load_configs()
+        state = self._load_configs()
         
         logger.info(f"[Config] Updating config: {config_id}")
         
-        for i, config in enumerate(configs):
-            if config.id == config_id:
-                updated_config = config.model_copy()
-                
-                if request.name is not None:
-                    updated_config.name = request.name
-                    logger.info(f"[Config] Updating name to: {request.name}")
-                if request.api_key is not None:
-                    updated_config.api_key = request.api_key
-                    logger.info("[Config] Updating API key")
-                if request.model_name is not None:
-                    updated_config.model_name = request.model_name
-                    logger.info(f"[Config] Updating model to: {request.model_name}")
-                if request.base_url is not None:
-                    updated_config.base_url = request.base_url
-                    logger.info(f"[Config] Updating base URL to: {request.base_url}")
-                
-                if request.custom_config is not None:
-                    if updated_config.provider.value == "custom":
-                        updated_config.custom_config = request.custom_config.model_dump()
-                        logger.info(f"[Config] Updating custom config")
-                    else:
-                        logger.warning(f"[Config] Cannot update custom_config for non-custom provider: {updated_config.provider.value}")
-                
-                if request.is_default is not None:
-                    if request.is_default:
-                        for c in configs:
-                            c.is_default = False
-                        logger.info(f"[Config] Setting {config_id} as default, clearing others")
-                    updated_config.is_default = request.is_default
-                
-                updated_config.updated_at = datetime.now().timestamp()
-                configs[i] = updated_config
-                self._save_configs(configs)
-                
-                logger.info(f"[Config] Config updated successfully: {config_id}")
-                return updated_config
+        i = state.by_id.get(config_id)
+        if i is None:
+            logger.warning(f"[Config] Config not found for update: {config_id}")
+            return None
+
+        updated_config = state.configs[i]
+        old_default = None
         
-        logger.warning(f"[Config] Config not found for update: {config_id}")
-        return None
+        if request.name is not None:
+            updated_config.name = request.name
+            logger.info(f"[Config] Updating name to: {request.name}")
+        if request.api_key is not None:
+            updated_config.api_key = request.api_key
+            logger.info("[Config] Updating API key")
+        if request.model_name is not None:
+            updated_config.model_name = request.model_name
+            logger.info(f"[Config] Updating model to: {request.model_name}")
+        if request.base_url is not None:
+            updated_config.base_url = request.base_url
+            logger.info(f"[Config] Updating base URL to: {request.base_url}")
+        
+        if request.custom_config is not None:
+            if updated_config.provider.value == "custom":
+                updated_config.custom_config = request.custom_config.model_dump()
+                logger.info(f"[Config] Updating custom config")
+            else:
+                logger.warning(f"[Config] Cannot update custom_config for non-custom provider: {updated_config.provider.value}")
+        
+        if request.is_default is not None:
+            if request.is_default:
+                old_default = self._clear_default(state)
+                logger.info(f"[Config] Setting {config_id} as default, clearing others")
+            updated_config.is_default = request.is_default
+        
+        updated_config.updated_at = time.time()
+        self._save_configs((old_default, i))
+        
+        logger.info(f"[Config] Config updated successfully: {config_id}")
+        return updated_config
     
     def delete_config(self, config_id: str) -> DeleteProviderConfigResponse:
-        configs = self._load_configs()
+        state = self._load_configs()
         
         logger.info(f"[Config] Deleting config: {config_id}")
         
-        for i, config in enumerate(configs):
-            if config.id == config_id:
-                config_name = config.name
-                configs.pop(i)
-                self._save_configs(configs)
-                logger.info(f"[Config] Config deleted successfully: {config_name} ({config_id})")
-                return DeleteProviderConfigResponse(
-                    success=True,
-                    message="Config deleted successfully"
-                )
-        
-        logger.warning(f"[Config] Config not found for deletion: {config_id}")
+        i = state.by_id.get(config_id)
+        if i is None:
+            logger.warning(f"[Config] Config not found for deletion: {config_id}")
+            return DeleteProviderConfigResponse(
+                success=False,
+                message="Config not found"
+            )
+
+        config_name = state.configs.pop(i).name
+        del state.dumps[i]
+        self._save_configs()
+        logger.info(f"[Config] Config deleted successfully: {config_name} ({config_id})")
         return DeleteProviderConfigResponse(
-            success=False,
-            message="Config not found"
+            success=True,
+            message="Config deleted successfully"
         )
     
     def set_default_config(self, config_id: str) -> Optional[APIProviderConfig]:
-        configs = self._load_configs()
+        state = self._load_configs()
         
         logger.info(f"[Config] Setting default config: {config_id}")
         
-        target_config = None
-        for config in configs:
-            if config.id == config_id:
-                target_config = config
-                break
-        
-        if target_config is None:
+        i = state.by_id.get(config_id)
+        if i is None:
             logger.warning(f"[Config] Config not found for setting default: {config_id}")
             return None
         
+        target_config = state.configs[i]
         logger.info(f"[Config] Setting {target_config.name} ({config_id}) as default")
-        for config in configs:
-            config.is_default = False
+        old_default = self._clear_default(state)
+        target_config.is_default = True
+        target_config.updated_at = time.time()
         
-        for i, config in enumerate(configs):
-            if config.id == config_id:
-                configs[i].is_default = True
-                configs[i].updated_at = datetime.now().timestamp()
-                break
-        
-        self._save_configs(configs)
+        self._save_configs((old_default, i))
         logger.info(f"[Config] Default config set successfully: {config_id}")
-        return configs[i]
+        return target_config
 
     def get_github_token(self) -> Optional[str]:
-        if os.path.exists(self.github_token_file):
-            try:
-                with open(self.github_token_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data.get("token")
-            except Exception as e:
-                print(f"Error loading GitHub token: {e}")
+        mtime = self._mtime(self.github_token_file)
+        if mtime is None:
+            return None
+        cached = self._gh_token_cache
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(self.github_token_file, 'rb') as f:
+                data = orjson.loads(f.read())
+                token = data.get("token")
+                self._gh_token_cache = (mtime, token)
+                return token
+        except Exception as e:
+            logger.error("[Config] Error loading GitHub token: %s", e)
         return None
 
     def update_github_token(self, request: UpdateGitHubTokenRequest) -> GitHubTokenResponse:
         try:
-            now = datetime.now().timestamp()
+            now = time.time()
             token_config = GitHubTokenConfig(
                 token=request.token,
                 created_at=now,
                 updated_at=now
             )
             
-            with open(self.github_token_file, 'w', encoding='utf-8') as f:
-                json.dump(token_config.model_dump(), f, indent=2, ensure_ascii=False)
+            self._atomic_write(
+                self.github_token_file,
+                orjson.dumps(token_config.model_dump(), option=orjson.OPT_INDENT_2)
+            )
+            self.github_token_version += 1
             
             return GitHubTokenResponse(
                 success=True,
@@ -245,6 +449,7 @@ class ConfigService:
         try:
             if os.path.exists(self.github_token_file):
                 os.remove(self.github_token_file)
+            self.github_token_version += 1
             
             return GitHubTokenResponse(
                 success=True,
@@ -262,4 +467,45 @@ class ConfigService:
         return os.path.exists(self.github_token_file)
 
 
+    # 以下为供 async 路由使用的版本：配置修改只动内存（落盘已在后台线程），
+    # 只有缓存失效需要读文件或 GitHub token 读写时才进线程池
+
+    async def aget_configs(self) -> List[APIProviderConfig]:
+        await self._aload_configs()
+        return self.get_configs()
+
+    async def aget_config_by_id(self, config_id: str) -> Optional[APIProviderConfig]:
+        await self._aload_configs()
+        return self.get_config_by_id(config_id)
+
+    async def aget_default_config(self) -> Optional[APIProviderConfig]:
+        await self._aload_configs()
+        return self.get_default_config()
+
+    async def acreate_config(self, request: CreateProviderConfigRequest) -> APIProviderConfig:
+        await self._aload_configs()
+        return self.create_config(request)
+
+    async def aupdate_config(self, config_id: str, request: UpdateProviderConfigRequest) -> Optional[APIProviderConfig]:
+        await self._aload_configs()
+        return self.update_config(config_id, request)
+
+    async def adelete_config(self, config_id: str) -> DeleteProviderConfigResponse:
+        await self._aload_configs()
+        return self.delete_config(config_id)
+
+    async def aset_default_config(self, config_id: str) -> Optional[APIProviderConfig]:
+        await self._aload_configs()
+        return self.set_default_config(config_id)
+
+    async def aupdate_github_token(self, request: UpdateGitHubTokenRequest) -> GitHubTokenResponse:
+        return await asyncio.to_thread(self.update_github_token, request)
+
+    async def adelete_github_token(self) -> GitHubTokenResponse:
+        return await asyncio.to_thread(self.delete_github_token)
+
+    async def ahas_github_token(self) -> bool:
+        return await asyncio.to_thread(self.has_github_token)
+
+
 config_service = ConfigService()
\ No newline at end of file
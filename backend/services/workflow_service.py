@@ -1,33 +1,33 @@
 from typing import Dict, Any
 from backend.models import WorkflowParseRequest, WorkflowParseResponse, WorkflowAnalysis
-from backend.tools.workflow_analyzer import WorkflowAnalyzer
+from backend.tools.workflow_analyzer import workflow_analyzer
 
 
 class WorkflowService:
     def __init__(self):
-        self.analyzer = WorkflowAnalyzer()
-    
+        self.analyzer = workflow_analyzer
+
     async def parse_workflow(self, request: WorkflowParseRequest) -> WorkflowParseResponse:
-        workflow_dict = request.workflow.model_dump()
-        
-        analysis = await self.analyzer.analyze_workflow(
-            workflow_dict,
-            request.language.value
-        )
-        
+        return await self.parse_workflow_from_dict(request.workflow.model_dump(), request.language.value)
+
+    async def parse_workflow_from_dict(self, workflow_dict: Dict[str, Any], language: str = "en") -> WorkflowParseResponse:
+        """已经是 dict 的工作流（如直接 json 解析所得）走这里，跳过 Pydantic 往返"""
+        analysis = await self.analyzer.analyze_workflow(workflow_dict, language)
+
         return WorkflowParseResponse(
             analysis=analysis,
             workflow_json=workflow_dict
         )
-    
+
     async def analyze_workflow(self, request: WorkflowParseRequest) -> Dict[str, Any]:
-        workflow_dict = request.workflow.model_dump()
-        
-        analysis = await self.analyzer.analyze_workflow(
-            workflow_dict,
-            request.language.value
-        )
-        
+        return await self.analyze_workflow_from_dict(request.workflow.model_dump(), request.language.value)
+
+    async def analyze_workflow_from_dict(self, workflow_dict: Dict[str, Any], language: str = "en") -> Dict[str, Any]:
+        analysis = await self.analyzer.analyze_workflow(workflow_dict, language)
+        return self._analysis_to_dict(analysis)
+
+    @staticmethod
+    def _analysis_to_dict(analysis: WorkflowAnalysis) -> Dict[str, Any]:
         return {
             "summary": analysis.summary,
             "data_flow": analysis.data_flow,
@@ -1,24 +1,17 @@
+from types import MappingProxyType
 from typing import Dict, Any, Optional
 from backend.action_history import action_history
 
 
 class ActionTools:
-    def __init__(self):
-        self.action_types = {
-            "update_config": self._update_config,
-            "install_node": self._install_node,
-            "modify_workflow": self._modify_workflow,
-            "fix_connection": self._fix_connection,
-            "reset_node": self._reset_node
-        }
-    
     async def execute_action(
         self,
         action_type: str,
         action_data: Dict[str, Any],
         session_id: str
     ) -> Dict[str, Any]:
-        if action_type not in self.action_types:
+        handler = self.action_types.get(action_type)
+        if handler is None:
             return {
                 "success": False,
                 "message": f"Unknown action type: {action_type}"
@@ -26,7 +19,7 @@ class ActionTools:
         
         previous_state = await self._capture_state(action_type, action_data)
         
-        action_id = action_history.add_action(
+        action_id = await action_history.add_action(
             session_id=session_id,
             action_type=action_type,
             action_data=action_data,
@@ -34,7 +27,7 @@ class ActionTools:
         )
         
         try:
-            result = await self.action_types[action_type](action_data)
+            result = await handler(self, action_data)
             result["action_id"] = action_id
             result["can_undo"] = True
             return result
@@ -47,7 +40,7 @@ class ActionTools:
             }
     
     async def undo_action(self, action_id: str) -> Dict[str, Any]:
-        action = action_history.get_action(action_id)
+        action = await action_history.get_action(action_id)
         
         if not action:
             return {
@@ -55,7 +48,7 @@ class ActionTools:
                 "message": "Action not found"
             }
         
-        previous_state = action_history.undo_action(action_id)
+        previous_state = await action_history.undo_action(action_id)
         
         if previous_state:
             return {
@@ -149,3 +142,12 @@ class ActionTools:
                 "default_values": default_values
             }
         }
+
+    # 类级别的分发表，存放未绑定的函数，不随实例重复构建
+    action_types = MappingProxyType({
+        "update_config": _update_config,
+        "install_node": _install_node,
+        "modify_workflow": _modify_workflow,
+        "fix_connection": _fix_connection,
+        "reset_node": _reset_node
+    })
@@ -1,65 +1,170 @@
-import httpx
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+from operator import itemgetter
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Tuple
+
+import orjson
+from cachetools import TTLCache
+
 from backend.config import settings, get_github_token
+from backend.mcp.http_client import get_github_client
+from backend.mcp.llm_client import get_gemini
+from backend.services.config_service import config_service
+
+logger = logging.getLogger(__name__)
+
+# GitHub search/issues 的每个 item 都带这些字段，一次取出
+_GH_ITEM_FIELDS = itemgetter("title", "html_url", "body", "state", "comments", "created_at", "updated_at")
+
+# 送入解决方案分析 prompt 的结果条数和每条正文的字符上限（网页 snippet 长度不受控）
+_SOLUTION_RESULTS = 5
+_SOLUTION_CONTENT_CHARS = 800
+
+_SOLUTION_SYSTEM_PROMPTS = MappingProxyType({
+    "en": "Analyze these search results and provide solutions in English.",
+    "zh": "分析这些搜索结果并用中文提供解决方案。",
+    "ja": "これらの検索結果を分析し、日本語で解決策を提供してください。",
+    "ko": "이 검색 결과를 분석하고 한국어로 솔루션을 제공하세요."
+})
+
+_SOLUTION_PROMPT_TEMPLATE = """
+            {system_prompt}
+            
+            Error Log:
+            {error_log}
+            
+            Search Results:
+            {results_text}
+            
+            Analyze the search results and provide a consolidated solution. 
+            Return in JSON format with these fields:
+            - description: Brief description of the solution
+            - steps: List of steps to fix the issue
+            - code_snippet: Any relevant code snippet (optional)
+            - requires_action: Boolean - can this be fixed automatically?
+            - action_type: Type of action if requires_action is true (e.g., "update_config", "install_node", "modify_workflow")
+            - action_data: Data needed for the action (optional)
+            """
+
+
+def _slice_json(text: str, opener: str, closer: str) -> Optional[str]:
+    """取第一个起始括号到最后一个结束括号之间的内容，等价于贪婪的 DOTALL 正则但无需回溯"""
+    start = text.find(opener)
+    if start == -1:
+        return None
+    end = text.rfind(closer)
+    if end < start:
+        return None
+    return text[start:end + 1]
 
 
 class SearchTools:
     def __init__(self):
         self.timeout = settings.REQUEST_TIMEOUT
+        self._token_cache: Optional[tuple] = None
+        # 同一排错会话里重复的搜索直接命中，5 分钟过期
+        self._github_cache: TTLCache = TTLCache(maxsize=256, ttl=300)
     
     def _get_github_token(self) -> Optional[str]:
-        return get_github_token()
+        """token 只在通过 ConfigService 更新/删除后才重新读取"""
+        version = config_service.github_token_version
+        cached = self._token_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        token = get_github_token()
+        self._token_cache = (version, token)
+        return token
     
     async def search_github(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        cache_key = (" ".join(query.split()).lower(), limit)
+        cached = self._github_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
         results = []
         
         try:
-            headers = {}
+            headers = {"Accept": "application/vnd.github+json"}
             github_token = self._get_github_token()
             if github_token:
                 headers["Authorization"] = f"token {github_token}"
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                search_query = f"{query} comfyui error issue"
-                url = f"https://api.github.com/search/issues"
-                params = {
-                    "q": search_query,
-                    "per_page": limit,
-                    "sort": "updated",
-                    "order": "desc"
-                }
-                
-                response = await client.get(url, headers=headers, params=params)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    for item in data.get("items", []):
-                        results.append({
+            # 复用 MCP 工具共用的长连接客户端，省去每次搜索的 TLS 握手
+            client = get_github_client()
+            search_query = f"{query} comfyui error issue"
+            url = f"https://api.github.com/search/issues"
+            params = {
+                "q": search_query,
+                "per_page": limit,
+                "sort": "updated",
+                "order": "desc"
+            }
+            
+            response = await client.get(url, headers=headers, params=params, timeout=self.timeout)
+            
+            if response.status_code == 200:
+                # 直接从字节解析，跳过 response.json() 先整体解码成 str 的一步
+                items = orjson.loads(response.content).get("items") or ()
+                try:
+                    results = [
+                        {
+                            "source": "github",
+                            "title": title,
+                            "url": url,
+                            "body": (body or "")[:500],
+                            "state": state,
+                            "comments": comments,
+                            "created_at": created_at,
+                            "updated_at": updated_at
+                        }
+                        for title, url, body, state, comments, created_at, updated_at in map(_GH_ITEM_FIELDS, items)
+                    ]
+                except KeyError:
+                    # 字段缺失时退回逐个带默认值的取法
+                    results = [
+                        {
                             "source": "github",
                             "title": item.get("title", ""),
                             "url": item.get("html_url", ""),
-                            "body": item.get("body", "")[:500],
+                            "body": (item.get("body") or "")[:500],
                             "state": item.get("state", ""),
                             "comments": item.get("comments", 0),
                             "created_at": item.get("created_at", ""),
                             "updated_at": item.get("updated_at", "")
-                        })
+                        }
+                        for item in items
+                    ]
+                self._github_cache[cache_key] = results
         except Exception as e:
-            print(f"GitHub search error: {e}")
+            logger.exception("GitHub search error")
         
-        return results
+        return list(results)
+    
+    async def search_all(
+        self, query: str, limit: int = 10
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """GitHub 和网页搜索互不依赖，并发执行；任一失败按空结果处理"""
+        github_results, web_results = await asyncio.gather(
+            self.search_github(query, limit),
+            self.search_web(query, limit),
+            return_exceptions=True
+        )
+        if isinstance(github_results, Exception):
+            logger.error(f"GitHub search failed: {github_results}")
+            github_results = []
+        if isinstance(web_results, Exception):
+            logger.error(f"Web search failed: {web_results}")
+            web_results = []
+        return github_results, web_results
     
     async def search_web(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
         results = []
         
         try:
-            from langchain_google_genai import ChatGoogleGenerativeAI
             from langchain_core.messages import HumanMessage
             
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.0-flash-exp",
-                api_key=settings.GOOGLE_API_KEY
-            )
+            llm = get_gemini("gemini-2.0-flash-exp")
             
             prompt = f"""
             Search the web for solutions to this ComfyUI error/problem:
@@ -76,13 +181,10 @@ class SearchTools:
             
             response = await llm.ainvoke([HumanMessage(content=prompt)])
             
-            import re
-            import json
-            
-            json_match = re.search(r'\[.*\]', response.content, re.DOTALL)
-            if json_match:
+            json_text = _slice_json(response.content, "[", "]")
+            if json_text:
                 try:
-                    parsed_results = json.loads(json_match.group())
+                    parsed_results = orjson.loads(json_text)
                     for item in parsed_results:
                         results.append({
                             "source": "web",
@@ -90,10 +192,10 @@ class SearchTools:
                             "url": item.get("url", ""),
                             "snippet": item.get("snippet", "")
                         })
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     pass
         except Exception as e:
-            print(f"Web search error: {e}")
+            logger.exception("Web search error")
         
         return results
     
@@ -107,63 +209,35 @@ class SearchTools:
             return []
         
         try:
-            from langchain_google_genai import ChatGoogleGenerativeAI
             from langchain_core.messages import HumanMessage, SystemMessage
-            from backend.config import settings
             
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.0-flash-exp",
-                api_key=settings.GOOGLE_API_KEY
-            )
+            llm = get_gemini("gemini-2.0-flash-exp")
             
-            language_map = {
-                "en": "Analyze these search results and provide solutions in English.",
-                "zh": "分析这些搜索结果并用中文提供解决方案。",
-                "ja": "これらの検索結果を分析し、日本語で解決策を提供してください。",
-                "ko": "이 검색 결과를 분석하고 한국어로 솔루션을 제공하세요."
-            }
-            
-            system_prompt = language_map.get(language, language_map["en"])
+            system_prompt = _SOLUTION_SYSTEM_PROMPTS.get(language, _SOLUTION_SYSTEM_PROMPTS["en"])
             
             results_text = "\n\n".join([
                 f"Source: {r['source']}\nTitle: {r['title']}\nURL: {r['url']}\n"
-                f"Content: {r.get('body', r.get('snippet', ''))}"
-                for r in search_results[:5]
+                f"Content: {str(r.get('body') or r.get('snippet') or '')[:_SOLUTION_CONTENT_CHARS]}"
+                for r in search_results[:_SOLUTION_RESULTS]
             ])
             
-            prompt = f"""
-            {system_prompt}
-            
-            Error Log:
-            {error_log}
-            
-            Search Results:
-            {results_text}
-            
-            Analyze the search results and provide a consolidated solution. 
-            Return in JSON format with these fields:
-            - description: Brief description of the solution
-            - steps: List of steps to fix the issue
-            - code_snippet: Any relevant code snippet (optional)
-            - requires_action: Boolean - can this be fixed automatically?
-            - action_type: Type of action if requires_action is true (e.g., "update_config", "install_node", "modify_workflow")
-            - action_data: Data needed for the action (optional)
-            """
+            prompt = _SOLUTION_PROMPT_TEMPLATE.format(
+                system_prompt=system_prompt,
+                error_log=error_log,
+                results_text=results_text
+            )
             
             response = await llm.ainvoke([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=prompt)
             ])
             
-            import re
-            import json
-            
-            json_match = re.search(r'\{.*\}', response.content, re.DOTALL)
-            if json_match:
+            json_text = _slice_json(response.content, "{", "}")
+            if json_text:
                 try:
-                    solution = json.loads(json_match.group())
+                    solution = orjson.loads(json_text)
                     return [solution]
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     pass
             
             return [{
@@ -172,5 +246,5 @@ class SearchTools:
                 "requires_action": False
             }]
         except Exception as e:
-            print(f"Solution analysis error: {e}")
+            logger.exception("Solution analysis error")
             return []
@@ -1,8 +1,248 @@
 
-from typing import Dict, Any, List, Optional, Union, Callable, Awaitable
+import asyncio
+import hashlib
+import logging
+from array import array
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable, Awaitable
+from backend.config import settings
 from backend.models import ComfyWorkflow, ComfyNode, WorkflowIssue, WorkflowAnalysis
-import json
 import re
+from string import Template
+from types import MappingProxyType
+
+import orjson
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _link_endpoints(link: Any):
+    """兼容数组和 Pydantic dump 后的字典两种格式，返回 (link_id, origin_id, target_id)"""
+    if isinstance(link, list) and len(link) >= 5:
+        return link[0], link[1], link[3]
+    if isinstance(link, dict):
+        return link.get("id"), link.get("origin_id"), link.get("target_id")
+    return None, None, None
+
+
+_DICT_LINK_ENDPOINTS = itemgetter("id", "origin_id", "target_id")
+
+
+@dataclass(slots=True)
+class WorkflowSoA:
+    """工作流的列式视图，分析器只需要 id 和类型时按列遍历"""
+    node_ids: List[Any]
+    node_types: List[str]
+    link_ids: array
+    link_src: array
+    link_dst: array
+
+    @classmethod
+    def from_workflow(cls, nodes: List[Dict[str, Any]], links: List[Any]) -> "WorkflowSoA":
+        # 按格式分成两组后批量解包：数组直接按位置取，字典用 itemgetter 一次取三个字段
+        endpoints = [(link[0], link[1], link[3]) for link in links if isinstance(link, list) and len(link) >= 5]
+        dict_links = [link for link in links if isinstance(link, dict)]
+        if dict_links:
+            try:
+                dict_endpoints = list(map(_DICT_LINK_ENDPOINTS, dict_links))
+            except KeyError:
+                dict_endpoints = [_link_endpoints(link) for link in dict_links]
+            endpoints.extend(dict_endpoints)
+        if endpoints:
+            try:
+                # 全部是合法 int 时整列直接构造 array
+                ids, src, dst = zip(*endpoints)
+                link_ids, link_src, link_dst = array("i", ids), array("i", src), array("i", dst)
+            except (TypeError, OverflowError):
+                link_ids, link_src, link_dst = cls._convert_endpoints(endpoints)
+        else:
+            link_ids, link_src, link_dst = array("i"), array("i"), array("i")
+        return cls(
+            node_ids=[node.get("id") for node in nodes],
+            node_types=[node.get("type", "Unknown") for node in nodes],
+            link_ids=link_ids,
+            link_src=link_src,
+            link_dst=link_dst
+        )
+
+    @staticmethod
+    def _convert_endpoints(endpoints: List[Tuple[Any, Any, Any]]) -> Tuple[array, array, array]:
+        """逐条转换，跳过缺失或非法的 id"""
+        link_ids, link_src, link_dst = array("i"), array("i"), array("i")
+        for l_id, origin_id, target_id in endpoints:
+            if l_id is None or target_id is None:
+                continue
+            try:
+                l_id, origin_id, target_id = int(l_id), int(origin_id if origin_id is not None else -1), int(target_id)
+            except (TypeError, ValueError, OverflowError):
+                continue
+            link_ids.append(l_id)
+            link_src.append(origin_id)
+            link_dst.append(target_id)
+        return link_ids, link_src, link_dst
+
+
+# LLM 分析的静态指令部分，与工作流内容和语言无关，作为 system prompt 命中供应商的前缀缓存
+_LLM_ANALYSIS_SYSTEM_PROMPT = """You are an expert ComfyUI workflow analyzer. 
+Your task is to analyze the provided workflow JSON and return a structured analysis in JSON format.
+
+[WORKFLOW STRUCTURE EXPLANATION]
+- Nodes have ID, Type, Inputs, and Outputs, encoded compactly as {"id", "t": type, "i": inputs, "o": outputs, "w": widget values}.
+- Each input is [name, link_id]; each output is [name, has_links].
+- Links array format: [link_id, origin_node_id, origin_slot_index, target_node_id, target_slot_index, type].
+- A connection exists if a link entry connects an Origin Node to a Target Node.
+
+[TASK]
+1. **Summary**: Briefly describe what this workflow does based on the nodes and connections.
+2. **Data Flow**: List the high-level flow of data (e.g., LoadImage -> KSampler -> SaveImage). Trace the links array to find actual connections.
+3. **Key Nodes**: Identify the most important nodes (CheckpointLoader, KSampler, SaveImage, etc.).
+4. **Issues**: specific errors.
+   - Check for nodes with missing inputs (where the input's link_id is null).
+   - Check for broken flows (e.g., KSampler not connected to VAE Decode).
+   - Count the links correctly based on the 'links' array.
+5. **Suggestions**: actionable advice to improve or fix the workflow.
+
+[OUTPUT FORMAT]
+Return ONLY valid JSON with this schema:
+{
+    "summary": "string",
+    "data_flow": ["string", "string"],
+    "key_nodes": [{"id": "string", "type": "string", "description": "string"}],
+    "issues": [
+        {"id": "unique_id", "node_id": int, "severity": "error|warning", "message": "string", "fix_suggestion": "string"}
+    ],
+    "suggestions": ["string"]
+}"""
+
+# 每次调用只替换工作流和语言两个字段
+_LLM_ANALYSIS_USER_TEMPLATE = Template("[WORKFLOW JSON]\n$workflow_json\n\nAnalyze in $language language.")
+
+# LLM 回复中 ```json 代码块的内容
+_JSON_BLOCK_RE = re.compile(r'```json\s*([\s\S]*?)\s*```')
+
+_ANALYSIS_CACHE_SIZE = 256
+
+# 关键节点识别的分类，按优先级排列：(node_categories 键, 分类名, 描述)
+_KEY_NODE_CATEGORIES = (
+    ("loaders", "loader", "Loads input data (images, models, etc.)"),
+    ("samplers", "sampler", "Generates images using the diffusion model"),
+    ("outputs", "output", "Saves or previews the generated images"),
+)
+
+# 未连接时不报缺失的可选或默认参数
+_OPTIONAL_INPUTS = frozenset(("seed", "width", "height", "batch_size", "clip"))
+
+
+# 确定性分析的多语言文案，导入时构建一次
+_SUMMARY_TEMPLATES = MappingProxyType({
+    "en": "This workflow contains {nodes} nodes. "
+          "Key components include {key_nodes} important nodes. "
+          "The workflow processes data through {connections} connections.",
+    "zh": "此工作流包含 {nodes} 个节点。"
+          "关键组件包括 {key_nodes} 个重要节点。"
+          "工作流通过 {connections} 个连接处理数据。",
+    "ja": "このワークフローには {nodes} 個のノードが含まれています。"
+          "主要コンポーネントには {key_nodes} 個の重要なノードがあります。",
+    "ko": "이 워크플로우에는 {nodes} 개의 노드가 포함되어 있습니다."
+          "주요 구성 요소에는 {key_nodes} 개의 중요한 노드가 있습니다."
+})
+
+_BASE_SUGGESTIONS = MappingProxyType({
+    "en": (
+        "Review the workflow connections for any missing links",
+        "Consider adding a preview node to see intermediate results",
+        "Check if all required custom nodes are installed"
+    ),
+    "zh": (
+        "检查工作流连接是否有缺失的链接",
+        "考虑添加预览节点以查看中间结果",
+        "检查是否已安装所有必需的自定义节点"
+    ),
+    "ja": (
+        "欠けているリンクがないかワークフロー接続を確認してください",
+        "中間結果を確認するためにプレビューノードを追加することを検討してください",
+        "必要なカスタムノードがすべてインストールされているか確認してください"
+    ),
+    "ko": (
+        "누락된 연결이 없는지 워크플로우 연결을 검토하세요",
+        "중간 결과를 보기 위해 미리보기 노드를 추가하는 것을 고려하세요",
+        "필요한 사용자 정의 노드가 모두 설치되어 있는지 확인하세요"
+    )
+})
+
+_FIX_PREFIXES = MappingProxyType({"en": "Fix", "zh": "修复", "ja": "修正", "ko": "수정"})
+
+_ISSUE_COUNT_TEMPLATES = MappingProxyType({
+    "en": "{errors} error(s) and {warnings} warning(s)",
+    "zh": "{errors} 个错误和 {warnings} 个警告",
+    "ja": "{errors} 個のエラーと {warnings} 個の警告",
+    "ko": "{errors} 개의 오류와 {warnings} 개의 경고"
+})
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _structure_key(nodes: List[Dict[str, Any]], links: List[Any], language: str) -> bytes:
+    """确定性分析只依赖节点 id/类型、输入名与连线、输出连线和 links 端点，按这些内容取哈希"""
+    structure = (
+        [
+            (
+                node.get("id"),
+                node.get("type"),
+                [(i.get("name"), i.get("link")) for i in node.get("inputs") or ()],
+                [o.get("links") for o in node.get("outputs") or ()]
+            )
+            for node in nodes
+        ],
+        [_link_endpoints(link) for link in links],
+        language
+    )
+    return _digest(orjson.dumps(structure, default=str))
+
+
+def _prompt_link(link: Any) -> Optional[List[Any]]:
+    # Convert links back to array format if they are dicts (from Pydantic)
+    # Structure: [id, origin_id, origin_slot, target_id, target_slot, type]
+    if isinstance(link, list):
+        return link
+    if isinstance(link, dict):
+        return [
+            link.get("id"),
+            link.get("origin_id"),
+            link.get("origin_slot"),
+            link.get("target_id"),
+            link.get("target_slot"),
+            link.get("type")
+        ]
+    return None
+
+
+def _dump_simplified(nodes: List[Dict[str, Any]], links: List[Any]) -> bytes:
+    """逐个节点序列化后拼接，不在内存中先构建完整的精简工作流；字段名缩写、输入输出用位置数组以节省 token"""
+    node_parts = b",".join(
+        orjson.dumps({
+            "id": n.get("id"),
+            "t": n.get("type"),
+            "i": [[i.get("name"), i.get("link")] for i in n.get("inputs", [])],
+            "o": [[o.get("name"), bool(o.get("links"))] for o in n.get("outputs", [])],
+            "w": n.get("widgets_values")
+        })
+        for n in nodes
+    )
+    link_parts = b",".join(
+        orjson.dumps(row) for row in map(_prompt_link, links) if row is not None
+    )
+    return b'{"nodes":[' + node_parts + b'],"links":[' + link_parts + b']}'
+
+
+# 节点数超过该值时把纯 CPU 的遍历放到线程里，避免长时间占用事件循环
+_OFFLOAD_NODE_COUNT = 500
+
 
 class WorkflowAnalyzer:
     def __init__(self):
@@ -16,6 +256,37 @@ class WorkflowAnalyzer:
             "image": ["ImageScale", "ImageUpscale", "ImageComposite", "ImageCrop"],
             "outputs": ["SaveImage", "PreviewImage", "SaveAnimatedWEBP"]
         }
+        # 每个关键分类编译成一个子串交替正则，按优先级依次匹配
+        self._category_patterns = [
+            (re.compile("|".join(map(re.escape, self.node_categories[key]))), name, desc)
+            for key, name, desc in _KEY_NODE_CATEGORIES
+        ]
+        # 已知节点类型精确命中时直接查表
+        self._category_index: Dict[str, Optional[Tuple[str, str]]] = {}
+        for types in self.node_categories.values():
+            for node_type in types:
+                self._category_index[node_type] = self._match_category(node_type)
+        # 按工作流结构哈希缓存分析结果（只读），迭代编辑时未变化的工作流直接命中
+        self._cache: "OrderedDict[bytes, WorkflowAnalysis]" = OrderedDict()
+        # LLM 分析结果按 (模型, prompt) 缓存并设 TTL，切换模型或旧回答过期后重新请求
+        self._llm_cache: TTLCache = TTLCache(maxsize=_ANALYSIS_CACHE_SIZE, ttl=settings.LLM_CACHE_TTL)
+
+    def _match_category(self, node_type: str) -> Optional[Tuple[str, str]]:
+        for pattern, name, desc in self._category_patterns:
+            if pattern.search(node_type):
+                return name, desc
+        return None
+
+    def _cache_get(self, key: bytes) -> Optional[WorkflowAnalysis]:
+        analysis = self._cache.get(key)
+        if analysis is not None:
+            self._cache.move_to_end(key)
+        return analysis
+
+    def _cache_put(self, key: bytes, analysis: WorkflowAnalysis) -> None:
+        self._cache[key] = analysis
+        if len(self._cache) > _ANALYSIS_CACHE_SIZE:
+            self._cache.popitem(last=False)
 
     async def analyze_workflow(
             self,
@@ -26,135 +297,102 @@ class WorkflowAnalyzer:
         # Note: This method is kept for compatibility but the agent should prefer analyze_workflow_with_llm
         nodes = workflow.get("nodes", [])
         links = workflow.get("links", [])
-
-        issues = await self._detect_issues(nodes, links)
-        data_flow = self._analyze_data_flow(nodes, links)
-        key_nodes = self._identify_key_nodes(nodes)
+        cache_key = _structure_key(nodes, links, language)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        soa = WorkflowSoA.from_workflow(nodes, links)
+
+        if len(nodes) >= _OFFLOAD_NODE_COUNT:
+            # 三个子分析互不依赖，并发执行
+            issues, data_flow, key_nodes = await asyncio.gather(
+                asyncio.to_thread(self._detect_issues, nodes, links, soa),
+                asyncio.to_thread(self._analyze_data_flow, nodes, links, soa),
+                asyncio.to_thread(self._identify_key_nodes, nodes)
+            )
+        else:
+            issues = self._detect_issues(nodes, links, soa)
+            data_flow = self._analyze_data_flow(nodes, links, soa)
+            key_nodes = self._identify_key_nodes(nodes)
         summary = self._generate_summary(nodes, data_flow, key_nodes, language)
         suggestions = self._generate_suggestions(issues, nodes, language)
 
-        return WorkflowAnalysis(
+        analysis = WorkflowAnalysis(
             summary=summary,
             data_flow=data_flow,
             key_nodes=key_nodes,
             issues=issues,
             suggestions=suggestions
         )
+        self._cache_put(cache_key, analysis)
+        return analysis
 
     async def analyze_workflow_with_llm(
         self, 
         workflow: Dict[str, Any], 
-        llm_call_func: Callable[[str], Awaitable[str]], 
-        language: str = "en"
+        llm_call_func: Callable[[str, str], Awaitable[str]], 
+        language: str = "en",
+        model_key: str = ""
     ) -> WorkflowAnalysis:
         """
         Uses an LLM to analyze the workflow, ensuring better understanding of connections and logic.
+        llm_call_func receives (system_prompt, user_prompt); the system part is static so providers can cache it.
+        model_key identifies the provider/model behind llm_call_func so cached analyses are not shared across models.
         """
         # 1. Simplify workflow to save tokens but keep essential structure
-        
-        # Helper: Convert links back to array format if they are dicts (from Pydantic)
-        # Structure: [id, origin_id, origin_slot, target_id, target_slot, type]
-        links_for_prompt = []
-        for l in workflow.get("links", []):
-            if isinstance(l, list):
-                links_for_prompt.append(l)
-            elif isinstance(l, dict):
-                links_for_prompt.append([
-                    l.get("id"),
-                    l.get("origin_id"),
-                    l.get("origin_slot"),
-                    l.get("target_id"),
-                    l.get("target_slot"),
-                    l.get("type")
-                ])
-
-        simplified = {
-            "nodes": [
-                {
-                    "id": n.get("id"),
-                    "type": n.get("type"),
-                    "inputs": [{"name": i.get("name"), "link_id": i.get("link")} for i in n.get("inputs", [])],
-                    "outputs": [{"name": o.get("name"), "has_links": bool(o.get("links"))} for o in n.get("outputs", [])],
-                    "widgets": n.get("widgets_values")
-                } for n in workflow.get("nodes", [])
-            ],
-            "links": links_for_prompt 
-        }
-        
-        prompt = f"""
-        You are an expert ComfyUI workflow analyzer. 
-        Your task is to analyze the provided workflow JSON and return a structured analysis in JSON format.
-
-        [WORKFLOW STRUCTURE EXPLANATION]
-        - Nodes have ID, Type, Inputs, and Outputs.
-        - Links array format: [link_id, origin_node_id, origin_slot_index, target_node_id, target_slot_index, type].
-        - A connection exists if a link entry connects an Origin Node to a Target Node.
-        
-        [TASK]
-        1. **Summary**: Briefly describe what this workflow does based on the nodes and connections.
-        2. **Data Flow**: List the high-level flow of data (e.g., LoadImage -> KSampler -> SaveImage). Trace the links array to find actual connections.
-        3. **Key Nodes**: Identify the most important nodes (CheckpointLoader, KSampler, SaveImage, etc.).
-        4. **Issues**: specific errors.
-           - Check for nodes with missing inputs (where 'link_id' is null).
-           - Check for broken flows (e.g., KSampler not connected to VAE Decode).
-           - Count the links correctly based on the 'links' array.
-        5. **Suggestions**: actionable advice to improve or fix the workflow.
-
-        [OUTPUT FORMAT]
-        Return ONLY valid JSON with this schema:
-        {{
-            "summary": "string",
-            "data_flow": ["string", "string"],
-            "key_nodes": [{{"id": "string", "type": "string", "description": "string"}}],
-            "issues": [
-                {{"id": "unique_id", "node_id": int, "severity": "error|warning", "message": "string", "fix_suggestion": "string"}}
-            ],
-            "suggestions": ["string"]
-        }}
-
-        [WORKFLOW JSON]
-        {json.dumps(simplified)}
-        
-        Analyze in {language} language.
-        """
-        
+        simplified = _dump_simplified(workflow.get("nodes", []), workflow.get("links", []))
+
+        user_prompt = _LLM_ANALYSIS_USER_TEMPLATE.substitute(
+            workflow_json=simplified.decode(),
+            language=language
+        )
+        # 同一模型、prompt 完全相同（含 widgets 和语言）时在 TTL 内复用上次 LLM 分析结果
+        cache_key = _digest(f"{model_key}\n{user_prompt}".encode("utf-8"))
+        cached = self._llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            response_text = await llm_call_func(prompt)
+            response_text = await llm_call_func(_LLM_ANALYSIS_SYSTEM_PROMPT, user_prompt)
             # Extract JSON from markdown code block if present
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response_text)
+            json_match = _JSON_BLOCK_RE.search(response_text)
             if json_match:
                 response_text = json_match.group(1)
             else:
                 # Fallback: try to find the first { and last }
-                json_match = re.search(r'(\{[\s\S]*\})', response_text)
-                if json_match:
-                    response_text = json_match.group(1)
+                start = response_text.find("{")
+                end = response_text.rfind("}")
+                if start != -1 and end > start:
+                    response_text = response_text[start:end + 1]
             
-            data = json.loads(response_text)
+            data = orjson.loads(response_text)
             
             # Convert to internal model
             issues = [WorkflowIssue(**i) for i in data.get("issues", [])]
             
-            return WorkflowAnalysis(
+            analysis = WorkflowAnalysis(
                 summary=data.get("summary", "Analysis failed"),
                 data_flow=data.get("data_flow", []),
                 key_nodes=data.get("key_nodes", []),
                 issues=issues,
                 suggestions=data.get("suggestions", [])
             )
-        except Exception as e:
-            print(f"LLM Analysis failed: {e}")
-            # Fallback to deterministic method
-            return await self.analyze_workflow(workflow, language)
-
-    async def _detect_issues(
+            self._llm_cache[cache_key] = analysis
+            return analysis
+        except Exception:
+            logger.exception("LLM Analysis failed")
+        # Fallback to deterministic method (memoized by structure, so repeated failures are cheap)
+        return await self.analyze_workflow(workflow, language)
+
+    def _detect_issues(
             self,
             nodes: List[Dict[str, Any]],
-            links: List[Any]  # Changed type hint to Any to cover both List and Dict
+            links: List[Any],  # Changed type hint to Any to cover both List and Dict
+            soa: Optional[WorkflowSoA] = None
     ) -> List[WorkflowIssue]:
+        if soa is None:
+            soa = WorkflowSoA.from_workflow(nodes, links)
         issues = []
-        for link in links:
-            pass
 
         for node in nodes:
             node_id = node.get("id")
@@ -165,7 +403,7 @@ class WorkflowAnalyzer:
                 if input_data.get("link") is None:
                     input_name = input_data.get("name", "")
                     # 忽略一些可选或默认参数
-                    if input_name not in ["seed", "width", "height", "batch_size", "clip"]:
+                    if input_name not in _OPTIONAL_INPUTS:
                         issues.append(WorkflowIssue(
                             id=f"missing_input_{node_id}_{idx}",
                             node_id=str(node_id),
@@ -174,8 +412,9 @@ class WorkflowAnalyzer:
                             fix_suggestion=f"Connect a node to the {input_name} input or provide a value"
                         ))
 
-        node_types = [node.get("type") for node in nodes]
-        if "KSampler" in node_types and "VAEDecode" not in node_types:
+        node_types = set(soa.node_types)
+        has_ksampler = "KSampler" in node_types
+        if has_ksampler and "VAEDecode" not in node_types:
             issues.append(WorkflowIssue(
                 id="missing_vae_decode",
                 node_id=None,
@@ -184,7 +423,7 @@ class WorkflowAnalyzer:
                 fix_suggestion="Add a VAE Decode node to convert latent images to visible images"
             ))
 
-        if "KSampler" in node_types and "SaveImage" not in node_types and "PreviewImage" not in node_types:
+        if has_ksampler and node_types.isdisjoint(("SaveImage", "PreviewImage")):
             issues.append(WorkflowIssue(
                 id="missing_output",
                 node_id=None,
@@ -198,92 +437,55 @@ class WorkflowAnalyzer:
     def _analyze_data_flow(
             self,
             nodes: List[Dict[str, Any]],
-            links: List[Any]
+            links: List[Any],
+            soa: Optional[WorkflowSoA] = None
     ) -> List[str]:
+        if soa is None:
+            soa = WorkflowSoA.from_workflow(nodes, links)
         data_flow = []
 
-        link_map = {}
-
-        # --- 【修复重点】兼容 List 和 Dict 两种格式的 Link ---
-        for link in links:
-            l_id, origin_id, origin_slot, target_id, target_slot = None, None, None, None, None
-
-            if isinstance(link, list) and len(link) >= 5:
-                # ComfyUI 标准数组格式: [id, origin_id, origin_slot, target_id, target_slot, type]
-                l_id = link[0]
-                origin_id = link[1]
-                origin_slot = link[2]
-                target_id = link[3]
-                target_slot = link[4]
-            elif isinstance(link, dict):
-                # Pydantic dump 后的字典格式
-                l_id = link.get("id")
-                origin_id = link.get("origin_id")
-                origin_slot = link.get("origin_slot")
-                target_id = link.get("target_id")
-                target_slot = link.get("target_slot")
-
-            # 只有当解析成功且有关联ID时才存入 map
-            if l_id is not None and target_id is not None:
-                # 强转为 str 以确保 map 查找时类型一致
-                link_map[str(l_id)] = {
-                    "origin_id": origin_id,
-                    "origin_slot": origin_slot,
-                    "target_id": target_id,
-                    "target_slot": target_slot
-                }
-        # ----------------------------------------------------
-
-        # 创建 ID 到 Node 的映射，注意 ID 可能是 int 或 str，统一转 str 处理或者保持原样
-        # 这里为了稳妥，查找时做类型兼容
-        node_dict = {str(node["id"]): node for node in nodes}
-
-        for node in nodes:
-            node_type = node.get("type", "Unknown")
-            node_id = node.get("id")
-
-            outputs = node.get("outputs", [])
-            for output in outputs:
-                # 检查 outputs 里的 links
-                node_links = output.get("links")
-                if node_links:
-                    for link_id in node_links:
-                        # 转换 link_id 为 str 进行查找
-                        str_link_id = str(link_id)
-                        if str_link_id in link_map:
-                            target_id = link_map[str_link_id]["target_id"]
-                            # 尝试获取 target node
-                            target_node = node_dict.get(str(target_id))
-
-                            if target_node:
-                                data_flow.append(
-                                    f"{node_type} (Node {node_id}) -> {target_node.get('type', 'Unknown')} (Node {target_id})"
-                                )
-
-        return data_flow[:10]
+        # 下游只用到目标节点：link_id -> target_id；同一 id 重复出现时以最后一条为准
+        link_targets = dict(zip(soa.link_ids, soa.link_dst))
+        # 节点 ID 可能是 int 或 str，统一转 str 查找
+        type_by_id = {str(node_id): node_type for node_id, node_type in zip(soa.node_ids, soa.node_types)}
+
+        for node, node_id, node_type in zip(nodes, soa.node_ids, soa.node_types):
+            for output in node.get("outputs", []):
+                for link_id in output.get("links") or ():
+                    try:
+                        target_id = link_targets.get(int(link_id))
+                    except (TypeError, ValueError):
+                        continue
+                    if target_id is None:
+                        continue
+                    target_type = type_by_id.get(str(target_id))
+                    if target_type is not None:
+                        data_flow.append(
+                            f"{node_type} (Node {node_id}) -> {target_type} (Node {target_id})"
+                        )
+                        if len(data_flow) >= 10:
+                            return data_flow
+
+        return data_flow
 
     def _identify_key_nodes(self, nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         key_nodes = []
 
+        category_index = self._category_index
         for node in nodes:
             node_type = node.get("type", "")
-            node_id = node.get("id")
-
-            # 简单的辅助函数来检查分类
-            def check_category(category_key, category_name, desc):
-                if any(cat_type in node_type for cat_type in self.node_categories[category_key]):
-                    key_nodes.append({
-                        "id": str(node_id),  # 统一 ID 为字符串
-                        "type": node_type,
-                        "category": category_name,
-                        "description": desc
-                    })
-                    return True
-                return False
-
-            if check_category("loaders", "loader", "Loads input data (images, models, etc.)"): continue
-            if check_category("samplers", "sampler", "Generates images using the diffusion model"): continue
-            if check_category("outputs", "output", "Saves or previews the generated images"): continue
+            if node_type in category_index:
+                match = category_index[node_type]
+            else:
+                match = self._match_category(node_type)
+            if match is None:
+                continue
+            key_nodes.append({
+                "id": str(node.get("id")),  # 统一 ID 为字符串
+                "type": node_type,
+                "category": match[0],
+                "description": match[1]
+            })
 
         return key_nodes
 
@@ -296,20 +498,8 @@ class WorkflowAnalyzer:
     ) -> str:
         node_count = len(nodes)
 
-        summaries = {
-            "en": f"This workflow contains {node_count} nodes. "
-                  f"Key components include {len(key_nodes)} important nodes. "
-                  f"The workflow processes data through {len(data_flow)} connections.",
-            "zh": f"此工作流包含 {node_count} 个节点。"
-                  f"关键组件包括 {len(key_nodes)} 个重要节点。"
-                  f"工作流通过 {len(data_flow)} 个连接处理数据。",
-            "ja": f"このワークフローには {node_count} 個のノードが含まれています。"
-                  f"主要コンポーネントには {len(key_nodes)} 個の重要なノードがあります。",
-            "ko": f"이 워크플로우에는 {node_count} 개의 노드가 포함되어 있습니다."
-                  f"주요 구성 요소에는 {len(key_nodes)} 개의 중요한 노드가 있습니다."
-        }
-
-        return summaries.get(language, summaries["en"])
+        template = _SUMMARY_TEMPLATES.get(language, _SUMMARY_TEMPLATES["en"])
+        return template.format(nodes=node_count, key_nodes=len(key_nodes), connections=len(data_flow))
 
     def _generate_suggestions(
             self,
@@ -317,48 +507,21 @@ class WorkflowAnalyzer:
             nodes: List[Dict[str, Any]],
             language: str = "en"
     ) -> List[str]:
-        suggestions = []
-
-        suggestions_map = {
-            "en": [
-                "Review the workflow connections for any missing links",
-                "Consider adding a preview node to see intermediate results",
-                "Check if all required custom nodes are installed"
-            ],
-            "zh": [
-                "检查工作流连接是否有缺失的链接",
-                "考虑添加预览节点以查看中间结果",
-                "检查是否已安装所有必需的自定义节点"
-            ],
-            "ja": [
-                "欠けているリンクがないかワークフロー接続を確認してください",
-                "中間結果を確認するためにプレビューノードを追加することを検討してください",
-                "必要なカスタムノードがすべてインストールされているか確認してください"
-            ],
-            "ko": [
-                "누락된 연결이 없는지 워크플로우 연결을 검토하세요",
-                "중간 결과를 보기 위해 미리보기 노드를 추가하는 것을 고려하세요",
-                "필요한 사용자 정의 노드가 모두 설치되어 있는지 확인하세요"
-            ]
-        }
-
-        base_suggestions = suggestions_map.get(language, suggestions_map["en"])
+        suggestions = list(_BASE_SUGGESTIONS.get(language, _BASE_SUGGESTIONS["en"]))
 
         if issues:
-            error_count = len([i for i in issues if i.severity == "error"])
-            warning_count = len([i for i in issues if i.severity == "warning"])
+            counts = Counter(issue.severity for issue in issues)
+            error_count, warning_count = counts["error"], counts["warning"]
 
             if error_count > 0 or warning_count > 0:
-                prefix = {
-                    "en": "Fix", "zh": "修复", "ja": "修正", "ko": "수정"
-                }.get(language, "Fix")
-                msg = {
-                    "en": f"{error_count} error(s) and {warning_count} warning(s)",
-                    "zh": f"{error_count} 个错误和 {warning_count} 个警告",
-                    "ja": f"{error_count} 个のエラーと {warning_count} 个の警告",
-                    "ko": f"{error_count} 개의 오류와 {warning_count} 개의 경고"
-                }.get(language, f"{error_count} errors")
+                prefix = _FIX_PREFIXES.get(language, "Fix")
+                msg = _ISSUE_COUNT_TEMPLATES.get(language, "{errors} errors").format(
+                    errors=error_count, warnings=warning_count
+                )
 
                 suggestions.insert(0, f"{prefix} {msg}")
 
-        return base_suggestions
+        return suggestions
+
+
+workflow_analyzer = WorkflowAnalyzer()
@@ -1,5 +1,6 @@
 import uvicorn
 from backend.main import app
+from backend.config import settings
 import logging
 
 logging.basicConfig(
@@ -31,7 +32,8 @@ if __name__ == "__main__":
             "backend.main:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            reload=settings.DEV_RELOAD,
+            workers=settings.WORKERS,
             log_level="info"
         )
     except KeyboardInterrupt: